@@ -45,13 +45,16 @@ class GrammarRule:
 class Grammar:
     language: str
     start_symbol: Symbol
-    rules: List[GrammarRule] = []  # list of GrammarRules
-    symbols: Mapping[str, Symbol] = {}  # map from strings to symbols
+    rules: List[GrammarRule]  # list of GrammarRules
+    symbols: Mapping[str, Symbol]  # map from strings to symbols
     rule_map: Mapping[tuple, GrammarRule] # map from RHSs to the matching rules
+    binary_rules: Mapping[Symbol, Mapping[Symbol, set]]  # map from left child to right child to parent symbols
 
     """initialize a new grammar from a srgs grammar file"""
     def __init__(self, lines, grammar_format="SRGS"):  # FIXME: maybe implement JSGF import in the future
         assert grammar_format == "SRGS", "illegal format descriptor: {}".format(grammar_format)
+        self.rules = []  # per instance, so that several grammars can coexist
+        self.symbols = {}
         lines = [re.sub("//.*$", "", line) for line in lines]  # remove comment lines
         lines = [line.strip() for line in lines if not re.match(r"^ *$", line)]  # remove empty lines
         assert lines.pop(0).lower() == "#abnf v1.0 utf-8;", "maybe something is wrong with header?"
@@ -72,8 +75,12 @@ class Grammar:
 
     def build_rule_map(self):
         self.rule_map = defaultdict(lambda: [])
+        self.binary_rules = {}
         for r in self.rules:
             self.rule_map[tuple(r.rhs)].append(r)
+            if len(r.rhs) == 2:
+                left, right = r.rhs
+                self.binary_rules.setdefault(left, {}).setdefault(right, set()).add(r.lhs)
 
 
     def get_symbol(self, symbol: str):
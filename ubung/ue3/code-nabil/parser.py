@@ -18,11 +18,15 @@ def is_in_language(words: list, grammar: Grammar) -> bool:
         for start in range(n - length + 1):
             end = start + length
             for mid in range(start + 1, end):
-                for rule in grammar.rules:
-                    if len(rule.rhs) == 2:  # Consider only binary rules
-                        left, right = rule.rhs
-                        if left in chart[start][mid] and right in chart[mid][end]:
-                            chart[start][end].add(rule.lhs)
+                # only look at binary rules whose children are actually in the two cells
+                for left in chart[start][mid]:
+                    right_map = grammar.binary_rules.get(left)
+                    if not right_map:
+                        continue
+                    for right in chart[mid][end]:
+                        parents = right_map.get(right)
+                        if parents:
+                            chart[start][end].update(parents)
 
     # Check if the start symbol is in the last cell of the chart
     return grammar.start_symbol in chart[0][n]
@@ -38,10 +42,10 @@ def parse(words: list, grammar: Grammar) -> list:
         # Recursive case: build trees using binary rules
         trees = []
         for mid in range(start + 1, end):
-            for rule in grammar.rules:
-                if len(rule.rhs) == 2:  # Consider only binary rules
-                    left, right = rule.rhs
-                    if left in chart[start][mid] and right in chart[mid][end]:
+            for left in chart[start][mid]:
+                right_map = grammar.binary_rules.get(left, {})
+                for right in chart[mid][end]:
+                    if symbol in right_map.get(right, ()):  # there is a rule symbol -> left right
                         left_trees = build_trees(chart, start, mid, left)
                         right_trees = build_trees(chart, mid, end, right)
                         # Combine left and right trees with current non-terminal symbol
@@ -65,11 +69,15 @@ def parse(words: list, grammar: Grammar) -> list:
         for start in range(n - length + 1):
             end = start + length
             for mid in range(start + 1, end):
-                for rule in grammar.rules:
-                    if len(rule.rhs) == 2:  # Consider only binary rules
-                        left, right = rule.rhs
-                        if left in chart[start][mid] and right in chart[mid][end]:
-                            chart[start][end].add(rule.lhs)
+                # only look at binary rules whose children are actually in the two cells
+                for left in chart[start][mid]:
+                    right_map = grammar.binary_rules.get(left)
+                    if not right_map:
+                        continue
+                    for right in chart[mid][end]:
+                        parents = right_map.get(right)
+                        if parents:
+                            chart[start][end].update(parents)
 
     # Generate parse trees using the built chart
     trees = build_trees(chart, 0, n, grammar.start_symbol)
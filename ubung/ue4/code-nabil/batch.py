@@ -0,0 +1,104 @@
+import argparse
+import contextlib
+import multiprocessing
+import os
+import sys
+import time
+
+import stats
+from grammar import *
+from parser import *  # type: ignore
+from treestore import TreeStore
+
+_worker_grammar = None  # the grammar of the current worker process, set once by _init_worker
+
+
+def _init_worker(grammar: Grammar):
+    global _worker_grammar
+    _worker_grammar = grammar
+
+
+def _parse_in_worker(task):
+    function, words, compact = task
+    return _compacted(function(words, _worker_grammar), compact)
+
+
+def _compacted(result, compact: bool):
+    """a list of trees as a TreeStore, which is much smaller to send back from a worker"""
+    return TreeStore.from_trees(result) if compact and isinstance(result, list) else result
+
+
+def iter_parse_many(sentences, grammar: Grammar, workers: int = None, function=parse, chunksize: int = 16,
+                    compact: bool = False):
+    """
+    lazily parses the sentences (strings or token lists) with a process pool and yields
+    function(words, grammar) for each of them, in input order.
+    the grammar is shipped to each worker once when the pool starts, not with every task.
+    with compact=True, lists of trees are returned as TreeStores (which print the same).
+    """
+    tasks = ((function, s.split() if isinstance(s, str) else s, compact) for s in sentences)
+    if workers == 1:
+        for function, words, compact in tasks:
+            yield _compacted(function(words, grammar), compact)
+        return
+    with multiprocessing.Pool(workers or os.cpu_count(), initializer=_init_worker, initargs=(grammar,)) as pool:
+        yield from pool.imap(_parse_in_worker, tasks, chunksize)
+
+
+def parse_many(sentences, grammar: Grammar, workers: int = None, function=parse, chunksize: int = 16,
+               compact: bool = False) -> list:
+    """parses all sentences in parallel and returns the list of results in input order"""
+    return list(iter_parse_many(sentences, grammar, workers, function, chunksize, compact))
+
+
+arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="parse a file with one sentence per line")
+arg_parser.add_argument('--grammar', type=str, default="../data/telescope.srgs")
+arg_parser.add_argument('--sentences', type=str, required=True, help="file with one sentence per line; - for stdin")
+arg_parser.add_argument('--no-cache', action='store_true', help="don't read or write the compiled grammar cache")
+arg_parser.add_argument('--normalize', action='store_true',
+                        help="convert the grammar to relaxed CNF before parsing (cached separately); in parse mode, "
+                             "the trees are printed with the original n-ary rules")
+arg_parser.add_argument('--workers', type=int, default=os.cpu_count())
+arg_parser.add_argument('--chunksize', type=int, default=16)
+arg_parser.add_argument('--mode', choices=["parse", "recognize", "count", "best"], default="parse",
+                        help="print all parses, whether the sentence is in the language, the number of parses "
+                             "or the Viterbi parse")
+arg_parser.add_argument('--profile', action='store_true',
+                        help="count the parser's work per sentence and print it with the heatmap of the costliest "
+                             "sentence to stderr; parses in this process, ignoring --workers")
+
+_modes = {"parse": parse, "recognize": is_in_language, "count": count_parses, "best": viterbi_parse}
+
+if __name__ == '__main__':
+    args = arg_parser.parse_args()
+    gr = load_grammar(args.grammar, use_cache=not args.no_cache, normalize=args.normalize)
+    if args.profile:
+        profile = stats.enable()
+        args.workers = 1  # the counters live in this process
+
+    def format_trees(trees) -> str:
+        """the trees (TreeNodes) as a bracketed list, with the original n-ary rules if the grammar was normalized"""
+        if args.normalize:
+            trees = [tree.remove_normalized_nodes(gr.normalization_record) for tree in trees]
+        return "[" + ", ".join(repr(tree) for tree in trees) + "]"
+
+    start = time.perf_counter()
+    count = 0
+    with contextlib.nullcontext(sys.stdin) if args.sentences == "-" else \
+            open(args.sentences, "r", encoding="utf-8") as source:
+        sentences = (line.strip() for line in source if line.strip())
+        for result in iter_parse_many(sentences, gr, args.workers, _modes[args.mode], args.chunksize, compact=True):
+            if args.mode == "parse":
+                result = format_trees(result)
+            elif args.mode == "best":  # the best tree as a list of at most one tree, then its score
+                tree, score = result
+                result = "{} {:.4f}".format(format_trees(TreeStore.from_trees([tree] if tree is not None else [])), score)
+            print(result)
+            count += 1
+    elapsed = time.perf_counter() - start
+    print("parsed {} sentences in {:.2f}s ({:.1f} sentences/s, {} workers)".format(
+        count, elapsed, count / elapsed if elapsed else 0.0, args.workers), file=sys.stderr)
+    if args.profile:
+        print(profile.report(), file=sys.stderr)
+        print(profile.heatmaps(), file=sys.stderr)
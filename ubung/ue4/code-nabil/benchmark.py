@@ -0,0 +1,507 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import earley
+import incremental
+import pickle
+import treestore
+import tracemalloc
+import parse as parse_module
+from grammar import *
+from parse import *
+from parser import *  # type: ignore
+
+
+def synthetic_grammar_lines(nonterminals=50, terminals=200, binary_rules=2000, seed=1, ambiguity=1):
+    """
+    random CNF grammar in our SRGS dialect; every nonterminal gets at least one lexical rule.
+    the number of binary rules per nonterminal pair and the number of preterminals per word (ambiguity)
+    control how many parses a sentence has.
+    """
+    rng = random.Random(seed)
+    nts = ["$X{}".format(i) for i in range(nonterminals)]
+    words = ["w{}".format(i) for i in range(terminals)]
+    lines = ["#ABNF V1.0 utf-8;", "language synthetic;"]
+    lines.append("public $S = {} {};".format(rng.choice(nts), rng.choice(nts)))
+    for nt in nts:
+        lines.append("{} = {};".format(nt, rng.choice(words)))
+    for _ in range(binary_rules):
+        lines.append("{} = {} {};".format(rng.choice(nts + ["$S"]), rng.choice(nts), rng.choice(nts)))
+    for word in words:
+        for _ in range(ambiguity):
+            lines.append("{} = {};".format(rng.choice(nts), word))
+    return lines
+
+
+def synthetic_nary_grammar_lines(nonterminals=50, terminals=200, rules=2000, max_length=5, seed=1):
+    """random grammar that is not in CNF: rules of up to max_length symbols, unary rules and terminals inside rules"""
+    rng = random.Random(seed)
+    nts = ["$X{}".format(i) for i in range(nonterminals)]
+    words = ["w{}".format(i) for i in range(terminals)]
+    lines = ["#ABNF V1.0 utf-8;", "language synthetic;"]
+    lines.append("public $S = {} {};".format(rng.choice(nts), rng.choice(nts)))
+    for nt in nts:
+        lines.append("{} = {};".format(nt, rng.choice(words)))
+    for _ in range(rules):
+        rhs = [rng.choice(nts) if rng.random() < 0.8 else rng.choice(words) for _ in range(rng.randint(1, max_length))]
+        lines.append("{} = {};".format(rng.choice(nts + ["$S"]), " ".join(rhs)))
+    return lines
+
+
+def sample_sentence(grammar, length, seed=1):
+    """sample a sentence of exactly `length` words by splitting spans top-down"""
+    rng = random.Random(seed)
+    binary, lexical = {}, {}
+    for rule in grammar.rules:
+        if len(rule.rhs) == 2:
+            binary.setdefault(rule.lhs, []).append(rule.rhs)
+        elif len(rule.rhs) == 1 and rule.rhs[0].terminal:
+            lexical.setdefault(rule.lhs, []).append(rule.rhs[0])
+    # yields[n] holds the symbols that derive n words with these rules, so expand only picks splits that work out
+    yields = [set(), set(lexical)]
+    for n in range(2, length + 1):
+        yields.append({lhs for lhs, rhss in binary.items()
+                       if any(left in yields[mid] and right in yields[n - mid]
+                              for left, right in rhss for mid in range(1, n))})
+    assert length >= 1 and grammar.start_symbol in yields[length], \
+        "{} derives no sentence of {} words".format(grammar.start_symbol, length)
+
+    def expand(symbol, n):
+        if n == 1:
+            return [rng.choice(lexical[symbol]).symbol]
+        left, right, mid = rng.choice([(left, right, mid) for left, right in binary[symbol] for mid in range(1, n)
+                                       if left in yields[mid] and right in yields[n - mid]])
+        return expand(left, mid) + expand(right, n - mid)
+
+    return expand(grammar.start_symbol, length)
+
+
+# the telescope grammar with n-ary rules and terminals inside rules, as the Earley parser can use it directly
+NARY_TELESCOPE_LINES = """#ABNF V1.0 utf-8;
+language en;
+public $S = $NP $VP;
+$NP = I;
+$NP = $Det $N;
+$NP = $Det $Adj $N;
+$NP = $NP with $NP;
+$VP = saw $NP;
+$VP = $VP with $NP;
+$VP = $V;
+$V = slept;
+$Det = the;
+$Det = a;
+$N = duck;
+$N = telescope;
+$Adj = big;
+""".split("\n")
+
+
+def _is_in_language_scan(words: list, grammar: Grammar) -> bool:
+    """reference CKY that scans all of grammar.rules per split point (the pre-index implementation)"""
+    n = len(words)
+    chart = [[set() for _ in range(n + 1)] for _ in range(n + 1)]
+    for i in range(1, n + 1):
+        for rule in grammar.rule_map.get((Symbol(words[i - 1]),), ()):
+            chart[i - 1][i].add(rule.lhs)
+    for length in range(2, n + 1):
+        for start in range(n - length + 1):
+            end = start + length
+            for mid in range(start + 1, end):
+                for rule in grammar.rules:
+                    if len(rule.rhs) == 2:
+                        left, right = rule.rhs
+                        if left in chart[start][mid] and right in chart[mid][end]:
+                            chart[start][end].add(rule.lhs)
+    return grammar.start_symbol in chart[0][n]
+
+
+def timed(function, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        clear_chart_cache()  # measure the work itself, not the chart cache
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def report(name, grammar, words):
+    scan_time, scan_result = timed(_is_in_language_scan, words, grammar)
+    index_time, index_result = timed(is_in_language, words, grammar)
+    assert scan_result == index_result
+    print("{:<32} rules={:<6} words={:<4} scan={:8.4f}s index={:8.4f}s speedup={:6.1f}x".format(
+        name, len(grammar.rules), len(words), scan_time, index_time, scan_time / index_time))
+
+
+def report_chart_memory(name, grammar, words):
+    """compare the bitmask chart cells with the equivalent cells as sets of Symbols"""
+    chart = fill_chart(words, grammar)
+    cells = [chart[start][end] for start in range(len(words)) for end in range(start + 1, len(words) + 1)]
+    bitmask_bytes = sum(sys.getsizeof(cell) for cell in cells)
+    set_bytes = sum(sys.getsizeof({grammar.nonterminals[i] for i in range(cell.bit_length()) if cell >> i & 1})
+                    for cell in cells)
+    print("{:<32} words={:<4} cells={:<6} set cells={:9d}B bitmask cells={:9d}B ({:5.1f}x smaller)".format(
+        name, len(words), len(cells), set_bytes, bitmask_bytes, set_bytes / bitmask_bytes))
+
+
+def report_forest(name, grammar, words, enumerate_trees=True):
+    """compare exhaustive tree enumeration with counting parses in the packed forest"""
+    forest_time, forest = timed(parse_forest, words, grammar)
+    count_time, count = timed(forest.count_parses)
+    line = "{:<32} words={:<4} parses={:<10d} forest items={:<6} forest+count={:8.4f}s".format(
+        name, len(words), count, len(forest), forest_time + count_time)
+    if enumerate_trees:
+        parse_time, trees = timed(parse, words, grammar, repeat=1)
+        assert len(trees) == count
+        line += " parse()={:8.4f}s".format(parse_time)
+    print(line)
+
+
+def _unshared_trees(forest, item):
+    """reference tree enumeration that derives every subtree again for each combination (no memoization)"""
+    start, end, symbol_id = item
+    symbol = forest.grammar.nonterminals[symbol_id]
+    if end - start == 1:
+        yield ParseNode(symbol, [ParseNode(Symbol(forest.words[start]))])
+        return
+    for mid, left, right in forest.items[item]:
+        for lt in _unshared_trees(forest, (start, mid, left)):
+            for rt in _unshared_trees(forest, (mid, end, right)):
+                yield ParseNode(symbol, [lt, rt])
+
+
+def report_node_allocations(name, grammar, words):
+    """count the ParseNodes allocated to enumerate all trees with and without shared subtrees"""
+    forest = parse_forest(words, grammar)
+
+    def allocations(trees):
+        before = parse_module._next_node_id()
+        start = time.perf_counter()
+        count = sum(1 for _ in trees)
+        return count, parse_module._next_node_id() - before - 1, time.perf_counter() - start
+
+    trees, unshared_nodes, unshared_time = allocations(_unshared_trees(forest, forest.root))
+    shared_trees, shared_nodes, shared_time = allocations(forest.trees())
+    assert trees == shared_trees
+    print("{:<32} words={:<4} trees={:<6} unshared nodes={:<9d}({:7.3f}s) shared nodes={:<7d}({:7.3f}s)".format(
+        name, len(words), trees, unshared_nodes, unshared_time, shared_nodes, shared_time))
+
+
+def report_k_best(name, grammar, words, k=10):
+    viterbi_time, (_, best_score) = timed(viterbi_parse, words, grammar)
+    k_best_time, k_best = timed(k_best_parses, words, grammar, k)
+    assert abs(k_best[0][0] - best_score) < 1e-9
+    print("{:<32} words={:<4} viterbi={:8.4f}s {}-best={:8.4f}s".format(
+        name, len(words), viterbi_time, k, k_best_time))
+
+
+def _startup_time(path, use_cache):
+    """time load_grammar in a fresh interpreter, the way a worker process starts; the cache goes next to path"""
+    code = "import time; from grammar import load_grammar; start = time.perf_counter(); " \
+           "load_grammar({!r}, {}, cache_dir={!r}); print(time.perf_counter() - start)".format(
+               path, use_cache, os.path.dirname(path))
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return float(output)
+
+
+def report_startup(name, lines):
+    """compare building a grammar from SRGS with loading its compiled cache"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "grammar.srgs")
+        with open(path, "w") as f:
+            f.write("\n".join(lines))
+        source_time = _startup_time(path, False)
+        _startup_time(path, True)  # writes the cache
+        cached_time = _startup_time(path, True)
+    print("{:<32} rules={:<6} from SRGS={:8.4f}s from cache={:8.4f}s ({:5.1f}x faster)".format(
+        name, len(lines) - 2, source_time, cached_time, source_time / cached_time))
+
+
+def report_chart_cache(name, grammar, words):
+    """a repeated query for the same sentence is answered from the chart cache"""
+    clear_chart_cache()
+    start = time.perf_counter()
+    is_in_language(words, grammar)
+    count_parses(words, grammar)
+    first_time = time.perf_counter() - start
+    start = time.perf_counter()
+    is_in_language(words, grammar)
+    count_parses(words, grammar)
+    repeated_time = time.perf_counter() - start
+    print("{:<32} words={:<4} first query={:8.4f}s repeated query={:8.6f}s".format(
+        name, len(words), first_time, repeated_time))
+
+
+def report_earley(name, lines, words):
+    """Earley on the original rules against CKY on the normalized grammar"""
+    original, normalized = Grammar(lines), Grammar(lines)
+    normalized.normalize_to_relaxedCNF()
+    earley_time, earley_result = timed(is_in_language, words, original, "earley")
+    cky_time, cky_result = timed(is_in_language, words, normalized)
+    assert earley_result == cky_result
+    earley_chart = earley.EarleyChart(words, original)
+    print("{:<32} rules={}/{} words={:<4} earley={:8.4f}s ({} items) cky after normalization={:8.4f}s".format(
+        name, len(original.rules), len(normalized.rules), len(words), earley_time,
+        sum(len(items) for items in earley_chart.items), cky_time))
+
+
+def report_normalization(name, lines, **options):
+    """grammar size before and after normalize_to_relaxedCNF, against one new symbol per rule position"""
+    grammar = Grammar(lines)
+    unshared = sum(len(r.rhs) - 2 + sum(s.terminal for s in r.rhs) for r in grammar.rules
+                   if len(r.rhs) > 2 and not all(s.terminal for s in r.rhs))
+    elapsed, sizes = timed(lambda: grammar.normalize_to_relaxedCNF(**options), repeat=1)
+    before, after = sizes["before"], sizes["after"]
+    print("{:<32} nonterminals={}->{} rules={}->{} rhs symbols={}->{} new symbols={} (unshared: about {}) in {:.4f}s".format(
+        name, before["nonterminals"], after["nonterminals"], before["rules"], after["rules"],
+        before["rhs_symbols"], after["rhs_symbols"], len(grammar.normalization_record), unshared, elapsed))
+
+
+def report_incremental(name, grammar, words):
+    """per-word latency of pushing into an incremental parser against refilling the chart for every prefix"""
+    parser = incremental.IncrementalParser(grammar)
+    push_times, refill_times = [], []
+    for i, word in enumerate(words):
+        start = time.perf_counter()
+        parser.push(word)
+        parser.is_viable()
+        push_times.append(time.perf_counter() - start)
+        refill_time, complete = timed(is_in_language, words[:i + 1], grammar, repeat=1)
+        refill_times.append(refill_time)
+        assert complete == parser.is_complete()
+    print("{:<32} words={:<4} last word: push={:8.5f}s refill={:8.5f}s; total push={:8.4f}s refill={:8.4f}s".format(
+        name, len(words), push_times[-1], refill_times[-1], sum(push_times), sum(refill_times)))
+
+
+def report_lexicon(grammar: Grammar, lexicon_path: str, sentences: int = 200):
+    """parse speed and index size with a large vocabulary, when half of the words are unknown"""
+    lexicon = load_lexicon(lexicon_path)
+    grammar.add_lexicon(lexicon, "$N")
+    entries = sorted(lexicon)
+    rng = random.Random(0)
+    words = [["I", "saw", "the", rng.choice(entries), "with", "a", rng.choice(entries) if i % 2 else "xyzzy{}".format(i)]
+             for i in range(sentences)]
+    masks_before, rules_before = len(grammar.lexical_masks), len(grammar.rule_map)
+    elapsed, _ = timed(lambda: [is_in_language(w, grammar) for w in words], repeat=1)
+    assert len(grammar.lexical_masks) == masks_before and len(grammar.rule_map) == rules_before
+    print("{:<32} entries={:<6} {} sentences in {:.4f}s, lexical index {} words, {} KB grammar, no growth on misses".format(
+        "lexicon " + os.path.basename(lexicon_path), len(lexicon), sentences, elapsed,
+        len(grammar.lexical_masks), grammar.memory_usage() // 1024))
+
+
+def random_tree(leaves: int, seed=1) -> ParseTree:
+    """a random binary parse tree with the given number of words, for the export benchmarks"""
+    rng = random.Random(seed)
+    symbols = [Symbol("$X{}".format(i)) for i in range(20)]
+
+    def build(n):
+        if n == 1:
+            return ParseNode(rng.choice(symbols), [ParseNode(Symbol("w{}".format(rng.randrange(100))))])
+        mid = rng.randint(1, n - 1)
+        return ParseNode(rng.choice(symbols), [build(mid), build(n - mid)])
+
+    return ParseTree(Symbol("$S"), [build(leaves)])
+
+
+def _to_dot_concat(tree: ParseTree) -> str:
+    """reference DOT export with string concatenation and recursion (the pre-streaming implementation)"""
+    def productions(node):
+        output = ""
+        for p in node.productions:
+            output += str(node.id) + " [label=\"" + node.symbol.symbol + "\"];\n"
+            output += str(node.id) + " -> " + str(p.id) + ";\n"
+            output += productions(p)
+        return output
+
+    def terminals(node):
+        return [(node.id, node.symbol)] if node.symbol.terminal else sum([terminals(p) for p in node.productions], start=[])
+
+    output = "digraph parsetree {\n{\nrankdir=\"LR\";\nnode [shape=\"box\"];\nedge [style=\"invis\"];\nrank=\"same\";\n"
+    for id, s in terminals(tree):
+        output += str(id) + " [label=\"" + str(s.symbol) + "\"];\n"
+    output += " -> ".join(str(id) for id, _ in terminals(tree))
+    output += ";\n}\n"
+    output += "rankdir=\"TB\";\n" + str(tree.id) + ";\nnode [shape=\"none\"]\nedge [style=\"solid\"];\n"
+    output += productions(tree)
+    return output + "}"
+
+
+def report_export(leaves: int):
+    """DOT, JSON and bracketed export of a large tree, and reading it back"""
+    tree = random_tree(leaves)
+    nodes = sum(1 for _ in tree.iter_nodes())
+    concat_time, concat_dot = timed(_to_dot_concat, tree, repeat=1)
+    stream_time, dot = timed(lambda: tree.write_dot(io.StringIO()), repeat=1)
+    assert tree.to_dot() == concat_dot
+    json_time, _ = timed(tree.to_json, repeat=1)
+    bracketed_time, bracketed = timed(repr, tree, repeat=1)
+    from_json_time, copy = timed(ParseTree.from_json, tree.to_json(), repeat=1)
+    from_bracketed_time, _ = timed(ParseTree.from_bracketed, bracketed, repeat=1)
+    assert repr(copy) == bracketed
+    print("{:<32} nodes={:<7} dot: concat={:8.4f}s stream={:8.4f}s; json={:8.4f}s bracketed={:8.4f}s; "
+          "read json={:8.4f}s bracketed={:8.4f}s".format("random tree", nodes, concat_time, stream_time, json_time,
+                                                         bracketed_time, from_json_time, from_bracketed_time))
+
+
+def report_tree_store(name, trees: list):
+    """memory and pickling of ParseNode trees against the same trees in a TreeStore"""
+    trees_pickle_time, trees_pickle = timed(pickle.dumps, trees, repeat=1)
+    tracemalloc.start()
+    copies = pickle.loads(trees_pickle)  # fresh ParseNodes, so that only they are measured
+    node_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    store = treestore.TreeStore.from_trees(copies)
+    assert repr(store) == repr(trees)
+    store_pickle_time, store_pickle = timed(pickle.dumps, store, repeat=1)
+    nodes = len({id(node) for tree in copies for node in tree.iter_nodes()})
+    print("{:<32} trees={:<6} nodes={:<7} ParseNodes={:9d}B ({:5.1f}B/node) store={:8d}B ({:4.1f}B/node); "
+          "pickle: {:9d}B {:6.4f}s vs {:8d}B {:6.4f}s".format(
+              name, len(trees), nodes, node_bytes, node_bytes / nodes, store.memory_usage(),
+              store.memory_usage() / len(store.symbols), len(trees_pickle), trees_pickle_time,
+              len(store_pickle), store_pickle_time))
+
+
+# sizes of the synthetic grammars of the suite: (nonterminals, terminals, binary rules)
+SUITE_SIZES = ((20, 100, 200), (50, 200, 2000), (100, 1000, 10000))
+SUITE_LENGTHS = (5, 10, 20, 30)
+SUITE_PARSE_LENGTH = 10  # parse() enumerates every tree, which explodes on longer sentences of dense grammars
+
+
+def run_suite(sizes=SUITE_SIZES, lengths=SUITE_LENGTHS, ambiguity=1, repeat=3) -> list:
+    """
+    times Grammar.__init__, normalize_to_relaxedCNF, is_in_language and parse on synthetic grammars
+    and sentences sampled from them. returns one record per measurement.
+    """
+    results = []
+
+    def record(benchmark, size, seconds, **details):
+        nonterminals, terminals, binary_rules = size
+        results.append({"benchmark": benchmark, "nonterminals": nonterminals, "terminals": terminals,
+                        "rules": binary_rules, "ambiguity": ambiguity, "seconds": seconds, **details})
+        print("{:<24} size={:<18} {:<20} {:10.6f}s".format(benchmark, str(size), " ".join(
+            "{}={}".format(key, value) for key, value in details.items()), seconds))
+
+    for size in sizes:
+        nonterminals, terminals, binary_rules = size
+        lines = synthetic_grammar_lines(nonterminals, terminals, binary_rules, ambiguity=ambiguity)
+        init_time, grammar = timed(Grammar, lines, repeat=repeat)
+        record("Grammar.__init__", size, init_time)
+
+        nary_lines = synthetic_nary_grammar_lines(nonterminals, terminals, binary_rules)
+        normalize_time = min(_time_normalization(nary_lines) for _ in range(repeat))
+        record("normalize_to_relaxedCNF", size, normalize_time)
+
+        for length in lengths:
+            words = sample_sentence(grammar, length)
+            recognize_time, _ = timed(is_in_language, words, grammar, repeat=repeat)
+            record("is_in_language", size, recognize_time, words=length)
+            if length <= SUITE_PARSE_LENGTH:
+                parse_time, parses = timed(parse, words, grammar, repeat=repeat)
+                record("parse", size, parse_time, words=length, parses=len(parses))
+    return results
+
+
+def _time_normalization(lines) -> float:
+    grammar = Grammar(lines)
+    start = time.perf_counter()
+    grammar.normalize_to_relaxedCNF()
+    return time.perf_counter() - start
+
+
+def _result_key(result: dict) -> tuple:
+    return tuple((key, value) for key, value in sorted(result.items()) if key not in ("seconds", "parses"))
+
+
+def compare_results(results: list, baseline: list, tolerance: float = 1.5) -> list:
+    """the measurements that got more than tolerance times slower than in the baseline (and at least 1 ms)"""
+    baseline_times = {_result_key(r): r["seconds"] for r in baseline}
+    regressions = []
+    for result in results:
+        before = baseline_times.get(_result_key(result))
+        if before is not None and result["seconds"] > tolerance * before and result["seconds"] - before > 0.001:
+            regressions.append((result, before))
+    return regressions
+
+
+arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="benchmark the parsers; without --json, print the detailed reports")
+arg_parser.add_argument('--json', type=str, help="run the synthetic suite and write the results to this file")
+arg_parser.add_argument('--baseline', type=str, help="results of an earlier --json run to check for regressions")
+arg_parser.add_argument('--tolerance', type=float, default=1.5, help="slowdown factor that counts as a regression")
+arg_parser.add_argument('--ambiguity', type=int, default=1, help="preterminals per word in the synthetic grammars")
+arg_parser.add_argument('--repeat', type=int, default=3, help="the best of this many runs is recorded")
+
+
+def main_suite(args):
+    results = run_suite(ambiguity=args.ambiguity, repeat=args.repeat)
+    with open(args.json, "w", encoding="utf-8") as f:
+        json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_results(results, json.load(f)["results"], args.tolerance)
+        for result, before in regressions:
+            print("REGRESSION {} size=({}, {}, {}) words={}: {:.6f}s -> {:.6f}s".format(
+                result["benchmark"], result["nonterminals"], result["terminals"], result["rules"],
+                result.get("words", "-"), before, result["seconds"]), file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+def main_reports():
+    report_startup("synthetic", synthetic_grammar_lines(nonterminals=200, terminals=5000, binary_rules=20000))
+
+    with open("../data/telescope.srgs", "r") as f:
+        telescope = Grammar(f.readlines())
+    report("telescope", telescope, "I saw the duck with a telescope".split(" "))
+
+    synthetic = Grammar(synthetic_grammar_lines())
+    for length in (10, 20):
+        report("synthetic", synthetic, sample_sentence(synthetic, length))
+
+    long_telescope = "I saw the duck with a telescope".split(" ") + "with a telescope".split(" ") * 15
+    report("telescope (long)", telescope, long_telescope)
+    report_chart_memory("telescope (long)", telescope, long_telescope)
+    report_chart_memory("synthetic", synthetic, sample_sentence(synthetic, 60))
+
+    for attachments in (4, 8):
+        report_forest("telescope (ambiguous)", telescope,
+                      "I saw the duck with a telescope".split(" ") + "with a telescope".split(" ") * attachments)
+    report_forest("telescope (long)", telescope, long_telescope, enumerate_trees=False)
+
+    twenty_words = "I saw the duck with a telescope".split(" ") + "with a telescope".split(" ") * 3 + ["with", "I"] * 2
+    report_node_allocations("telescope (ambiguous)", telescope, twenty_words)
+    report_k_best("telescope (long)", telescope, long_telescope)
+    report_chart_cache("telescope (long)", telescope, long_telescope)
+
+    report_incremental("telescope (long)", telescope, long_telescope)
+    for leaves in (1000, 10000, 50000):
+        report_export(leaves)
+    report_tree_store("random tree", [random_tree(10000)])
+    report_tree_store("telescope (ambiguous)", list(parse_forest(twenty_words, telescope).trees()))
+    with open("../data/telescope.srgs", "r") as f:
+        report_lexicon(Grammar(f.read().splitlines()), "../../ue2/Cocolab_DE.lex")
+
+    for attachments in (0, 5, 10, 20):
+        report_earley("n-ary telescope", NARY_TELESCOPE_LINES,
+                      "I saw the duck with a big telescope".split(" ") + "with a telescope".split(" ") * attachments)
+
+    report_normalization("n-ary telescope", NARY_TELESCOPE_LINES)
+    nary_lines = synthetic_nary_grammar_lines(rules=5000, max_length=8)
+    report_normalization("synthetic n-ary", nary_lines)
+    report_normalization("synthetic n-ary, no unit rules", nary_lines, remove_unit=True)
+
+
+if __name__ == "__main__":
+    args = arg_parser.parse_args()
+    if args.json:
+        sys.exit(main_suite(args))
+    main_reports()
@@ -0,0 +1,136 @@
+from grammar import *
+from parse import *
+
+
+class EarleyChart:
+    """
+    Earley chart over the original (n-ary, not normalized) rules of a grammar.
+    an item (rule index, dot, origin) at position k means that grammar.rules[rule index].rhs[:dot]
+    produces words[origin:k]. predictions are filtered with the grammar's left-corner table,
+    so only rules that can start with the next word are ever added.
+    """
+    words: tuple
+    grammar: Grammar
+    items: list  # items[k] is the set of items ending at position k
+    completed: set  # (rule index, start, end) for every rule that produces words[start:end]
+    ends: dict  # map from (nonterminal, start) to the set of positions where it can end
+
+    def __init__(self, words, grammar: Grammar):
+        self.words = tuple(words)
+        self.grammar = grammar
+        self.completed = set()
+        self.ends = {}
+        self._fill()
+
+    def _fill(self):
+        words, rules = self.words, self.grammar.rules
+        rules_by_lhs, first_words = self.grammar.rules_by_lhs, self.grammar.rule_first_words
+        n = len(words)
+        self.items = [set() for _ in range(n + 1)]
+        waiting = [{} for _ in range(n + 1)]  # waiting[k][B]: items at k whose dot is in front of B
+
+        def predict(symbol, k):
+            if k < n:
+                for rule_id in rules_by_lhs.get(symbol, ()):
+                    if words[k] in first_words[rule_id]:
+                        add((rule_id, 0, k), k)
+
+        def add(item, k):
+            if item not in self.items[k]:
+                self.items[k].add(item)
+                agenda.append(item)
+
+        for k in range(n + 1):
+            agenda = []
+            if k == 0:
+                predict(self.grammar.start_symbol, 0)
+            else:
+                agenda.extend(self.items[k])
+            while agenda:
+                rule_id, dot, origin = agenda.pop()
+                rhs = rules[rule_id].rhs
+                if dot < len(rhs):
+                    symbol = rhs[dot]
+                    if symbol.terminal:  # scan
+                        if k < n and words[k] == symbol.symbol:
+                            self.items[k + 1].add((rule_id, dot + 1, origin))
+                    else:  # predict, once per symbol and position
+                        if symbol not in waiting[k]:
+                            waiting[k][symbol] = []
+                            predict(symbol, k)
+                        waiting[k][symbol].append((rule_id, dot, origin))
+                else:  # complete
+                    lhs = rules[rule_id].lhs
+                    self.completed.add((rule_id, origin, k))
+                    self.ends.setdefault((lhs, origin), set()).add(k)
+                    for waiting_rule, waiting_dot, waiting_origin in waiting[origin].get(lhs, ()):
+                        add((waiting_rule, waiting_dot + 1, waiting_origin), k)
+
+    def is_in_language(self) -> bool:
+        return len(self.words) in self.ends.get((self.grammar.start_symbol, 0), ())
+
+    def trees(self):
+        """
+        lazily yields the parse trees (as ParseNodes rooted in the start symbol).
+        subtrees are derived once per (symbol, start, end) and shared between trees;
+        derivations that would run through a unary cycle are skipped.
+        """
+        if self.is_in_language():
+            yield from self._derive(self.grammar.start_symbol, 0, len(self.words), 0, {})
+
+    def _derive(self, symbol, start, end, visited, memo):
+        """
+        the trees of symbol over words[start:end] whose unary rules don't lead back to the visited symbols,
+        the bitmask of those above it over the same span (see unary_visited; they are part of the memo key,
+        since the trees of a symbol inside a unary cycle depend on where the cycle was entered)
+        """
+        key = (symbol, start, end, visited)
+        if key in memo:
+            yield from memo[key]
+            return
+        grammar = self.grammar
+        symbol_id = grammar.symbol_ids[symbol]
+        trees = []
+        for rule_id in grammar.rules_by_lhs.get(symbol, ()):
+            if (rule_id, start, end) not in self.completed:
+                continue
+            rhs = grammar.rules[rule_id].rhs
+            if len(rhs) == 1 and not rhs[0].terminal:  # a unary rule, over the same span
+                child_id = grammar.symbol_ids[rhs[0]]
+                if child_id == symbol_id or visited >> child_id & 1:  # unary cycle
+                    continue
+                child_visited = unary_visited(grammar, visited, symbol_id, child_id)
+                trees.extend(ParseNode(symbol, [tree]) for tree in self._derive(rhs[0], start, end, child_visited, memo))
+            else:
+                trees.extend(ParseNode(symbol, children) for children in self._split(rhs, 0, start, end, memo))
+        memo[key] = trees
+        yield from trees
+
+    def _split(self, rhs, dot, start, end, memo):
+        """yields the lists of child nodes with which rhs[dot:] produces words[start:end]"""
+        if dot == len(rhs):
+            if start == end:
+                yield []
+            return
+        symbol = rhs[dot]
+        if symbol.terminal:
+            if start < end and self.words[start] == symbol.symbol:
+                for rest in self._split(rhs, dot + 1, start + 1, end, memo):
+                    yield [ParseNode(Symbol(self.words[start]))] + rest
+            return
+        # every remaining symbol needs at least one word, so the children of rules with more than one symbol
+        # have shorter spans and start a new unary chain
+        for mid in sorted(self.ends.get((symbol, start), ())):
+            if mid <= end - (len(rhs) - dot - 1):
+                for tree in list(self._derive(symbol, start, mid, 0, memo)):
+                    for rest in self._split(rhs, dot + 1, mid, end, memo):
+                        yield [tree] + rest
+
+
+def is_in_language(words: list, grammar: Grammar) -> bool:
+    return EarleyChart(words, grammar).is_in_language()
+
+
+def parse(words: list, grammar: Grammar) -> list:
+    """returns all parse trees, like parser.parse, but without normalizing the grammar first"""
+    return [ParseTree(grammar.start_symbol, [tree]) for tree in EarleyChart(words, grammar).trees()]
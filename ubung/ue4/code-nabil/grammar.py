@@ -1,5 +1,14 @@
+import hashlib
+import heapq
+import itertools
+import math
+import os
+import pickle
 import re
-from collections import defaultdict
+import sys
+import threading
+from array import array
+from collections import OrderedDict
 from typing import List, Tuple, Mapping
 
 
@@ -32,31 +41,148 @@ class GrammarRule:
 
     lhs: Symbol
     rhs: List[Symbol]  # it's a list of Symbols
+    weight: float  # SRGS /weight/ of the rule, used as its probability by the Viterbi parser
 
-    def __init__(self, lhs: Symbol, rhs: list):
-        self.lhs, self.rhs = lhs, rhs
+    def __init__(self, lhs: Symbol, rhs: list, weight: float = 1.0):
+        self.lhs, self.rhs, self.weight = lhs, rhs, weight
 
     def __eq__(self, other):
         return self.lhs == other.lhs and self.rhs == other.rhs
 
     def __repr__(self):
-        return str(self.lhs) + " = " + " ".join([str(s) for s in self.rhs]) + ";"
+        weight = "/{}/ ".format(self.weight) if self.weight != 1.0 else ""
+        return str(self.lhs) + " = " + weight + " ".join([str(s) for s in self.rhs]) + ";"
     
     def __hash__(self):
         # Ensure that GrammarRule objects are hashable
         return hash((self.lhs, tuple(self.rhs)))
 
 
+class LexicalTrie:
+    """
+    the lexical entries of more than one word ($City = New York;) as a trie over words.
+    the nodes are parallel lists indexed by node id, the root is node 0: children[node] maps the next word
+    to its node, masks[node] is the bitmask of the preterminals whose entry ends there, scores[node] maps
+    their ids to log weights and prefix_masks[node] has the preterminals whose entry goes on after it.
+    lookups only read, so unknown words never add anything.
+    """
+    children: List[Mapping[str, int]]
+    masks: List[int]
+    scores: List[Mapping[int, float]]
+    prefix_masks: List[int]
+    max_length: int  # number of words of the longest entry, 0 if there is none
+
+    def __init__(self):
+        self.children, self.masks, self.scores, self.prefix_masks = [{}], [0], [{}], [0]
+        self.max_length = 0
+
+    def add(self, words: list, symbol_id: int, score: float):
+        node = 0
+        for word in words:
+            self.prefix_masks[node] |= 1 << symbol_id
+            if word not in self.children[node]:
+                self.children[node][word] = len(self.children)
+                self.children.append({})
+                self.masks.append(0)
+                self.scores.append({})
+                self.prefix_masks.append(0)
+            node = self.children[node][word]
+        self.masks[node] |= 1 << symbol_id
+        self.scores[node][symbol_id] = max(score, self.scores[node].get(symbol_id, -math.inf))
+        self.max_length = max(self.max_length, len(words))
+
+    def find(self, words: list, start: int, end: int) -> int:
+        """the node reached by words[start:end], or -1"""
+        node = 0
+        for i in range(start, end):
+            node = self.children[node].get(words[i], -1)
+            if node < 0:
+                break
+        return node
+
+    def mask(self, words: list, start: int, end: int) -> int:
+        """bitmask of the preterminals with an entry words[start:end]"""
+        node = self.find(words, start, end) if end - start <= self.max_length else -1
+        return self.masks[node] if node > 0 else 0
+
+    def prefix_mask(self, words: list, start: int, end: int) -> int:
+        """bitmask of the preterminals with an entry that starts with words[start:end] and goes on after it"""
+        node = self.find(words, start, end) if end - start < self.max_length else -1
+        return self.prefix_masks[node] if node > 0 else 0
+
+    def entry_scores(self, words: list, start: int, end: int) -> Mapping[int, float]:
+        """map from the ids of the preterminals with an entry words[start:end] to their log weights"""
+        node = self.find(words, start, end) if end - start <= self.max_length else -1
+        return self.scores[node] if node > 0 else {}
+
+    def __bool__(self):
+        return self.max_length > 0
+
+
+def load_lexicon(path: str) -> Mapping[str, List[str]]:
+    """
+    reads a lexicon file with one entry per line, the (possibly multi-word) spelling and its pronunciation
+    separated by a tab, as ue2/Cocolab_DE.lex. returns a map from spellings to their pronunciations.
+    """
+    lexicon = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            spelling, _, pronunciation = line.rstrip("\n").partition("\t")
+            if spelling.strip():
+                lexicon.setdefault(" ".join(spelling.split()), []).append(pronunciation.strip())
+    return lexicon
+
+
+def is_synthetic_symbol(symbol: Symbol) -> bool:
+    """whether normalize_to_relaxedCNF would name a new symbol like this, for trees whose grammar is not at hand"""
+    return not symbol.terminal and re.search(r"_NT\d*$", symbol.symbol) is not None
+
+
+_revisions = itertools.count()  # source of Grammar.revision
+_LEFT_CORNER_TABLES = ("rules_by_lhs", "left_corner_words", "rule_first_words")  # built by build_left_corners
+
+
 class Grammar:
     language: str
     start_symbol: Symbol
-    rules: List[GrammarRule] = []  # list of GrammarRules
-    symbols: Mapping[str, Symbol] = {}  # map from strings to symbols
+    rules: List[GrammarRule]  # list of GrammarRules
+    symbols: Mapping[str, Symbol]  # map from strings to symbols
     rule_map: Mapping[tuple, GrammarRule] # map from RHSs to the matching rules
+    nonterminals: List[Symbol]  # dense integer ids: nonterminals[id] is the symbol with that id
+    symbol_ids: Mapping[Symbol, int]  # map from nonterminal symbols to their ids
+    lexical_masks: Mapping[str, int]  # map from words to the bitmask of their preterminals
+    lexical_trie: LexicalTrie  # the lexical entries of more than one word
+    unknown_word: Symbol  # the preterminal that words without a lexical entry are read as, or None
+    unknown_mask: int  # bitmask of unknown_word, 0 if it is None
+    unknown_scores: Mapping[int, float]  # the lexical_scores entry of an unknown word
+    right_masks: List[int]  # per left child id: bitmask of right children that occur with it
+    parent_masks: List[Mapping[int, int]]  # per left child id: map from right child id to bitmask of parents
+    lexical_scores: Mapping[str, Mapping[int, float]]  # map from words to preterminal ids to log weights
+    binary_scores: List[Mapping[int, Mapping[int, float]]]  # per left child id: right child id -> parent id -> log weight
+    has_unary_rules: bool  # whether there are rules $A = $B (with a single nonterminal on the right)
+    unary_closure: List[int]  # per id B: bitmask of all A with A =>* B via unary rules (including B itself)
+    unary_rules: List[Mapping[int, float]]  # per id A: map from B to the best log weight of a rule $A = $B
+    unary_chains: List[Mapping[int, List[int]]]  # per id A: map from B to the ids on the best chain A => ... => B
+    unary_chain_scores: List[Mapping[int, float]]  # per id A: map from B to the summed log weights of that chain
+    unary_components: List[int]  # per id A: bitmask of A and the symbols B with A =>+ B =>+ A via unary rules
+    left_closure: List[int]  # per id B: bitmask of all A with A =>* B ... (B is a left corner of A)
+    rules_by_lhs: Mapping[Symbol, List[int]]  # map from nonterminals to the indexes of their rules
+    left_corner_words: Mapping[Symbol, set]  # map from nonterminals to the words they can start with
+    rule_first_words: List[set]  # per rule index: the words the rule can start with
+    revision: int  # unique per grammar and set of chart tables, used to key cached charts
+    chart_cache: OrderedDict  # map from (revision, words) to the Charts kept by parser.get_chart, least recent first
+    chart_cache_lock: threading.Lock  # guards chart_cache for parses on several threads
+    normalization_record: Mapping[Symbol, List[GrammarRule]]  # map from symbols added by normalization to the
+                                                              # original rules they help to express
 
     """initialize a new grammar from a srgs grammar file"""
     def __init__(self, lines, grammar_format="SRGS"):  # FIXME: maybe implement JSGF import in the future
         assert grammar_format == "SRGS", "illegal format descriptor: {}".format(grammar_format)
+        self.rules = []  # per instance, so that several grammars can coexist
+        self.symbols = {}
+        self.chart_cache, self.chart_cache_lock = OrderedDict(), threading.Lock()
+        self.unknown_word = None
+        self.normalization_record = {}
         lines = [re.sub("//.*$", "", line) for line in lines]  # remove comment lines
         lines = [line.strip() for line in lines if not re.match(r"^ *$", line)]  # remove empty lines
         assert lines.pop(0).lower() == "#abnf v1.0 utf-8;", "maybe something is wrong with header?"
@@ -68,18 +194,268 @@ class Grammar:
             assert match and len(match.groups()) == 3, "cannot parse line {}".format(line)
             is_public = match.group(1) != ""
             lhs = self.get_symbol(match.group(2))
-            rhs = [self.get_symbol(s) for s in re.split(r"\s+", match.group(3))]
-            rule = GrammarRule(lhs, rhs)
+            weight = 1.0
+            weighted = re.match(r"/\s*([^/\s]+)\s*/\s*(.*)", match.group(3))  # SRGS weight: $A = /0.5/ $B $C;
+            if weighted:
+                weight = float(weighted.group(1))
+                assert weight > 0, "weights must be positive: {}".format(line)
+            rhs = [self.get_symbol(s) for s in re.split(r"\s+", weighted.group(2) if weighted else match.group(3))]
+            rule = GrammarRule(lhs, rhs, weight)
             self.rules.append(rule)
             if is_public:
                 self.start_symbol = lhs
         self.build_rule_map()
 
     def build_rule_map(self):
-        self.rule_map = defaultdict(lambda: [])
+        self.index_rules()
+        self.build_symbol_table()
+        for name in _LEFT_CORNER_TABLES:  # rebuilt on demand from the new rules
+            self.__dict__.pop(name, None)
+
+    def index_rules(self):
+        self.rule_map = {}  # a plain dict, so that looking up unknown words does not add entries
         for r in self.rules:
-            self.rule_map[tuple(r.rhs)].append(r)
+            self.rule_map.setdefault(tuple(r.rhs), []).append(r)
+
+    def build_left_corners(self):
+        """
+        tables for the Earley parser: the rules per left-hand side, and for every rule the set of words
+        it can start with (a fixpoint over the left-corner relation, so left recursion is fine).
+        a rule that occurs twice is only indexed once, so it does not make every tree it is used in twice
+        """
+        self.rules_by_lhs = {}
+        indexed = set()
+        for i, r in enumerate(self.rules):
+            if (r.lhs, tuple(r.rhs)) not in indexed:
+                indexed.add((r.lhs, tuple(r.rhs)))
+                self.rules_by_lhs.setdefault(r.lhs, []).append(i)
+        first_words = {}
+        changed = True
+        while changed:
+            changed = False
+            for r in self.rules:
+                corner = r.rhs[0]
+                words = {corner.symbol} if corner.terminal else first_words.get(corner, set())
+                known = first_words.setdefault(r.lhs, set())
+                if not words <= known:
+                    known |= words
+                    changed = True
+        self.left_corner_words = first_words
+        self.rule_first_words = [{r.rhs[0].symbol} if r.rhs[0].terminal else first_words.get(r.rhs[0], set())
+                                 for r in self.rules]
 
+    def __getattr__(self, name):
+        # grammars loaded with from_compiled() only build the Symbol-keyed index when it is first used
+        if name == "rule_map" and "rules" in self.__dict__:
+            self.index_rules()
+            return self.__dict__[name]
+        # the Earley tables are only built if the Earley parser is used
+        if name in _LEFT_CORNER_TABLES and "rules" in self.__dict__:
+            self.build_left_corners()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def build_symbol_table(self):
+        """assign dense integer ids to the nonterminals and precompute the bitmasks used for chart cells"""
+        self.revision = next(_revisions)
+        self.nonterminals = []
+        self.symbol_ids = {}
+        for r in self.rules:
+            for s in [r.lhs] + list(r.rhs):
+                if not s.terminal and s not in self.symbol_ids:
+                    self.symbol_ids[s] = len(self.nonterminals)
+                    self.nonterminals.append(s)
+        self.lexical_masks = {}
+        self.lexical_trie = LexicalTrie()
+        self.right_masks = [0] * len(self.nonterminals)
+        self.parent_masks = [{} for _ in self.nonterminals]
+        self.lexical_scores = {}
+        self.binary_scores = [{} for _ in self.nonterminals]
+        for r in self.rules:
+            lhs_id = self.symbol_ids[r.lhs]
+            lhs_bit = 1 << lhs_id
+            score = math.log(r.weight)
+            if len(r.rhs) == 1 and r.rhs[0].terminal:
+                word = r.rhs[0].symbol
+                self.lexical_masks[word] = self.lexical_masks.get(word, 0) | lhs_bit
+                scores = self.lexical_scores.setdefault(word, {})
+                scores[lhs_id] = max(score, scores.get(lhs_id, -math.inf))
+            elif len(r.rhs) > 1 and all(s.terminal for s in r.rhs):
+                self.lexical_trie.add([s.symbol for s in r.rhs], lhs_id, score)
+            elif len(r.rhs) == 2 and not r.rhs[0].terminal and not r.rhs[1].terminal:
+                left, right = self.symbol_ids[r.rhs[0]], self.symbol_ids[r.rhs[1]]
+                self.right_masks[left] |= 1 << right
+                self.parent_masks[left][right] = self.parent_masks[left].get(right, 0) | lhs_bit
+                scores = self.binary_scores[left].setdefault(right, {})
+                scores[lhs_id] = max(score, scores.get(lhs_id, -math.inf))
+        self.build_unary_closure()
+        self.build_left_closure()
+        self.set_unknown_word(repr(self.unknown_word) if self.unknown_word else None)
+
+    def set_unknown_word(self, preterminal: str = None):
+        """
+        for robust parsing: words that have no lexical entry are read as the preterminal (e.g. "$N")
+        instead of making the sentence fail. None switches this off again.
+        """
+        symbol_id = self.symbol_ids.get(Symbol(preterminal)) if preterminal else None
+        assert preterminal is None or symbol_id is not None, "not a nonterminal of the grammar: {}".format(preterminal)
+        self.unknown_word = self.get_symbol(preterminal) if preterminal else None
+        self.unknown_mask = 1 << symbol_id if preterminal else 0
+        self.unknown_scores = {symbol_id: 0.0} if preterminal else {}
+        self.revision = next(_revisions)  # the charts of this grammar change
+
+    def build_unary_closure(self):
+        """
+        precompute which nonterminals derive which others through chains of unary rules.
+        from every symbol, a best-first search over the chains finds the one with the highest summed log weight
+        to each reachable symbol (what Viterbi needs); a chain never visits a symbol twice,
+        so cycles like $A = $B; $B = $A; are harmless.
+        """
+        self.unary_rules = [{} for _ in self.nonterminals]
+        for r in self.rules:
+            if len(r.rhs) == 1 and not r.rhs[0].terminal and r.rhs[0] != r.lhs:
+                lhs_id, rhs_id = self.symbol_ids[r.lhs], self.symbol_ids[r.rhs[0]]
+                self.unary_rules[lhs_id][rhs_id] = max(math.log(r.weight), self.unary_rules[lhs_id].get(rhs_id, -math.inf))
+        self.has_unary_rules = any(self.unary_rules)
+        self.unary_closure = [1 << i for i in range(len(self.nonterminals))]
+        self.unary_chains = [{} for _ in self.nonterminals]
+        self.unary_chain_scores = [{} for _ in self.nonterminals]
+        for top in range(len(self.nonterminals)):
+            chains, scores = self.unary_chains[top], self.unary_chain_scores[top]
+            agenda = [(-0.0, top, [])]
+            while agenda:
+                cost, symbol_id, chain = heapq.heappop(agenda)
+                if symbol_id != top and -cost < scores[symbol_id]:  # a better chain to it was found meanwhile
+                    continue
+                for child, rule_score in self.unary_rules[symbol_id].items():
+                    score = rule_score - cost
+                    if child != top and child not in chain and score > scores.get(child, -math.inf):
+                        chains[child] = chain + [child]
+                        scores[child] = score
+                        self.unary_closure[child] |= 1 << top
+                        heapq.heappush(agenda, (-score, child, chains[child]))
+        # symbols with a unary cycle through both of them; only these can come back on a chain
+        self.unary_components = [self.unary_closure[i] & sum(1 << j for j in self.unary_chains[i]) | 1 << i
+                                 for i in range(len(self.nonterminals))]
+
+    def build_left_closure(self):
+        """
+        for prefix parsing: precompute for every symbol B which symbols A have B as a left corner,
+        i.e. A =>* B ... through unary rules and binary rules whose right child can produce some words
+        """
+        productive = 0  # bitmask of the symbols that can produce some words
+        changed = True
+        while changed:
+            changed = False
+            for r in self.rules:
+                lhs_bit = 1 << self.symbol_ids[r.lhs]
+                if not productive & lhs_bit and \
+                        all(s.terminal or productive >> self.symbol_ids[s] & 1 for s in r.rhs):
+                    productive |= lhs_bit
+                    changed = True
+        left_parents = [0] * len(self.nonterminals)  # per id B: the A with a rule A = B or A = B C
+        for r in self.rules:
+            if 1 <= len(r.rhs) <= 2 and not r.rhs[0].terminal and \
+                    all(s.terminal or productive >> self.symbol_ids[s] & 1 for s in r.rhs[1:]):
+                left_parents[self.symbol_ids[r.rhs[0]]] |= 1 << self.symbol_ids[r.lhs]
+        self.left_closure = _reachable_masks(left_parents)
+
+    def to_compiled(self, source_hash: str) -> dict:
+        """
+        compact form of the grammar: one symbol table, the rules as flat integer arrays
+        and the precomputed chart tables, so loading needs no regexes and no index building
+        """
+        names = [repr(s) for s in self.nonterminals]
+        terminal_ids = {}
+        for r in self.rules:
+            for s in r.rhs:
+                if s.terminal and s not in terminal_ids:
+                    terminal_ids[s] = len(names)
+                    names.append(repr(s))
+        lhs, rhs_offsets, rhs, weights = array("i"), array("i", [0]), array("i"), array("d")
+        for r in self.rules:
+            lhs.append(self.symbol_ids[r.lhs])
+            rhs.extend(terminal_ids[s] if s.terminal else self.symbol_ids[s] for s in r.rhs)
+            rhs_offsets.append(len(rhs))
+            weights.append(r.weight)
+        return {"version": COMPILED_GRAMMAR_VERSION, "source_hash": source_hash,
+                "language": self.language, "start_symbol": self.symbol_ids[self.start_symbol],
+                "names": names, "nonterminals": len(self.nonterminals),
+                "lhs": lhs, "rhs_offsets": rhs_offsets, "rhs": rhs, "weights": weights,
+                "normalization_record": {repr(symbol): [(repr(r.lhs), [repr(x) for x in r.rhs], r.weight) for r in rules]
+                                         for symbol, rules in self.normalization_record.items()},
+                **{table_name: getattr(self, table_name) for table_name in _CHART_TABLES}}
+
+    @classmethod
+    def from_compiled(cls, compiled: dict):
+        """rebuilds a grammar from to_compiled() output without parsing any SRGS"""
+        grammar = cls.__new__(cls)
+        grammar.chart_cache, grammar.chart_cache_lock = OrderedDict(), threading.Lock()
+        grammar.language = compiled["language"]
+        grammar.symbols = {}
+        table = [grammar.get_symbol(name) for name in compiled["names"]]
+        grammar.normalization_record = {grammar.get_symbol(name): [
+            GrammarRule(grammar.get_symbol(lhs), [grammar.get_symbol(x) for x in rhs], weight) for lhs, rhs, weight in rules]
+            for name, rules in compiled["normalization_record"].items()}
+        grammar.nonterminals = table[:compiled["nonterminals"]]
+        grammar.symbol_ids = {s: i for i, s in enumerate(grammar.nonterminals)}
+        grammar.start_symbol = table[compiled["start_symbol"]]
+        offsets, rhs_ids, weights = compiled["rhs_offsets"], compiled["rhs"], compiled["weights"]
+        grammar.rules = [GrammarRule(table[lhs_id], [table[j] for j in rhs_ids[offsets[i]:offsets[i + 1]]], weights[i])
+                         for i, lhs_id in enumerate(compiled["lhs"])]
+        for table_name in _CHART_TABLES:
+            setattr(grammar, table_name, compiled[table_name])
+        grammar.set_unknown_word(None)
+        return grammar
+
+    def __getstate__(self):
+        # the cached charts stay in this process (a pickled grammar is sent to batch workers once), and locks don't pickle
+        return {name: value for name, value in self.__dict__.items() if name not in _RUNTIME_STATE}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.chart_cache, self.chart_cache_lock = OrderedDict(), threading.Lock()
+
+    def clear_chart_cache(self):
+        """drops the charts that parser.get_chart keeps for sentences of this grammar"""
+        with self.chart_cache_lock:
+            self.chart_cache.clear()
+
+    def memory_usage(self) -> int:
+        """approximate number of bytes held by this grammar's rules, symbols and lookup tables"""
+        seen = set()
+        todo = [self.__getstate__()]
+        size = 0
+        while todo:
+            obj = todo.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            size += sys.getsizeof(obj)
+            if isinstance(obj, dict):
+                todo.extend(obj.keys())
+                todo.extend(obj.values())
+            elif isinstance(obj, (list, tuple, set, frozenset)):
+                todo.extend(obj)
+            elif hasattr(obj, "__dict__"):
+                todo.append(obj.__dict__)
+        return size
+
+    def add_lexicon(self, lexicon, preterminal: str, weight: float = 1.0):
+        """
+        adds a rule preterminal = entry; for every entry of the lexicon (e.g. from load_lexicon)
+        that the grammar does not have yet. entries with spaces become multi-word entries.
+        """
+        lhs = self.get_symbol(preterminal)
+        known = {tuple(r.rhs) for r in self.rules if r.lhs == lhs}
+        for entry in lexicon:
+            if any(word.startswith("$") for word in entry.split()):
+                continue  # would be read as a nonterminal
+            rhs = [self.get_symbol(word) for word in entry.split()]
+            if rhs and tuple(rhs) not in known:
+                known.add(tuple(rhs))
+                self.rules.append(GrammarRule(lhs, rhs, weight))
+        self.build_rule_map()
 
     def get_symbol(self, symbol: str):
         if symbol not in self.symbols:
@@ -87,10 +463,18 @@ class Grammar:
         return self.symbols[symbol]
 
     def __repr__(self):
-        return "#ABNF V1.0 utf-8\n" + \
-               "language " + self.language + "\n" + \
+        # SRGS that Grammar() reads back
+        return "#ABNF V1.0 utf-8;\n" + \
+               self.language + "\n" + \
                "\n".join([str(r) if r.lhs != self.start_symbol else "public " + str(r) for r in self.rules])
 
+    def size(self) -> dict:
+        """the numbers that chart cost depends on"""
+        return {"nonterminals": len({s for r in self.rules for s in [r.lhs] + list(r.rhs) if not s.terminal}),
+                "terminals": len({s for r in self.rules for s in r.rhs if s.terminal}),
+                "rules": len(self.rules),
+                "rhs_symbols": sum(len(r.rhs) for r in self.rules)}
+
     # H 3.1
     def is_CNF(self):
         for rule in self.rules:
@@ -103,68 +487,296 @@ class Grammar:
     
     # H 4.1.2
     def is_relaxedCNF(self) -> bool:
+        """CNF plus unary rules $A = $B; and lexical entries of several words, which the CKY parser handles directly"""
         for rule in self.rules:
+            if all(symbol.terminal for symbol in rule.rhs):
+                continue  # lexical entry
             if len(rule.rhs) > 2:
                 return False  # Rule is not binary
-            if len(rule.rhs) == 2:
-                if any(not symbol.terminal for symbol in rule.rhs):
-                    return False  # Binary rule produces a terminal
-            elif len(rule.rhs) == 1:
-                if rule.rhs[0].terminal:
-                    return False  # Unary rule produces a terminal
+            if any(symbol.terminal for symbol in rule.rhs):
+                return False  # Terminal next to a non-terminal
         return True
     
     # H 4.1.3
-    def normalize_to_relaxedCNF(self):
-        # Create dictionaries to store normalized rules, public rules, and start symbol
-        normalized_rules = {}
-        public_rules = {}
-        start_symbol = None
+    def normalize_to_relaxedCNF(self, remove_epsilon: bool = False, remove_unit: bool = False) -> dict:
+        """
+        rewrites the rules into relaxed CNF (see is_relaxedCNF): a terminal inside a longer rule gets a preterminal,
+        and rules longer than two symbols are binarised right-branching. the new symbols are hash-consed:
+        one preterminal per word and one symbol per distinct rest of a right-hand side, so rules that end alike
+        share them, which keeps the number of nonterminals (and so the chart cells) small.
+        each new symbol is recorded in normalization_record with the original rules it helps to express,
+        for ParseNode.remove_normalized_nodes. the weight of a rule stays on its topmost new rule.
+        remove_epsilon removes rules with an empty right-hand side ($A = ; or $A = $NULL;) by adding the
+        variants of the rules without the symbols that can be empty (the empty sentence itself is dropped).
+        remove_unit replaces unary rules $A = $B; by the rules of B (the parser can also handle them as they are).
+        returns the size() of the grammar before and after.
+        """
+        before = self.size()
+        preterminals = {}  # map from words to their new preterminals
+        suffixes = {}  # map from rests of right-hand sides (tuples of symbols) to their new symbols
+        rules = []
+
+        def record(symbol, rule):
+            rules_of_symbol = self.normalization_record.setdefault(symbol, [])
+            if rule not in rules_of_symbol:
+                rules_of_symbol.append(rule)
 
-        # Iterate over each rule in the grammar
         for rule in self.rules:
-            # Track public rules and start symbol
-            if "public" in str(rule):
-                public_rules[rule.lhs] = rule.rhs
-            if rule.lhs == self.start_symbol:
-                start_symbol = rule.lhs
+            rhs = list(rule.rhs)
+            if len(rhs) > 1 and not all(s.terminal for s in rhs):
+                for i, s in enumerate(rhs):
+                    if s.terminal and not _is_epsilon_symbol(s):
+                        if s not in preterminals:
+                            preterminals[s] = self._new_symbol()
+                            rules.append(GrammarRule(preterminals[s], [s]))
+                        record(preterminals[s], rule)
+                        rhs[i] = preterminals[s]
+            if len(rhs) > 2 and not all(s.terminal for s in rhs):
+                tail = rhs[-1]
+                for i in range(len(rhs) - 2, 0, -1):  # from the shortest rest to the longest
+                    suffix = tuple(rhs[i:])
+                    if suffix not in suffixes:
+                        suffixes[suffix] = self._new_symbol()
+                        rules.append(GrammarRule(suffixes[suffix], [rhs[i], tail]))
+                    tail = suffixes[suffix]
+                    record(tail, rule)
+                rhs = [rhs[0], tail]
+            rules.append(GrammarRule(rule.lhs, rhs, rule.weight))
 
-            if len(rule.rhs) > 2:
-                # If the rule has more than two symbols on the right-hand side, split it into binary rules
-                lhs = rule.lhs
-                non_terminals = [Symbol(f"${lhs.symbol}_NT{i}") for i in range(len(rule.rhs) - 1)]
-                for i, rhs_symbol in enumerate(rule.rhs[:-1]):
-                    new_rule = GrammarRule(lhs, [rhs_symbol, non_terminals[i]])
-                    normalized_rules.setdefault(lhs, set()).add(tuple(new_rule.rhs))
-                    lhs = non_terminals[i]
-                new_rule = GrammarRule(lhs, [rule.rhs[-1]])
-                normalized_rules.setdefault(lhs, set()).add(tuple(new_rule.rhs))
-            elif len(rule.rhs) == 1 and not rule.rhs[0].terminal:
-                # If the rule is unary, replace it with a binary rule
-                new_symbol = Symbol(f"${rule.lhs.symbol}_NT")
-                new_rule = GrammarRule(rule.lhs, [rule.rhs[0], new_symbol])
-                normalized_rules.setdefault(rule.lhs, set()).add(tuple(new_rule.rhs))
-            else:
-                # Keep the rule unchanged
-                normalized_rules.setdefault(rule.lhs, set()).add(tuple(rule.rhs))
-
-        # Update the grammar with normalized rules, public rules, and start symbol
-        self.rules = [GrammarRule(lhs, list(rhs_list)) for lhs, rhs_list in normalized_rules.items()]
-        self.rules.extend([GrammarRule(lhs, list(rhs_list)) for lhs, rhs_list in public_rules.items()])
-        self.start_symbol = start_symbol
+        if remove_epsilon:
+            rules = _remove_epsilon_rules(rules)
+        if remove_unit:
+            rules = _remove_unit_rules(rules)
+        self.rules = _merge_duplicate_rules(rules)
+        self.build_rule_map()
+        return {"before": before, "after": self.size()}
 
-    def __repr__(self):
-        # Format the grammar rules as a string
-        grammar_str = "#ABNF V1.0 utf-8;\n"
-        grammar_str += f"{self.language}\n"
+    def _new_symbol(self) -> Symbol:
+        """a nonterminal that the grammar does not use yet, named so that is_synthetic_symbol recognises it"""
+        number = len(self.normalization_record)
+        while "$_NT{}".format(number) in self.symbols:
+            number += 1
+        return self.get_symbol("$_NT{}".format(number))
 
-        for rule in self.rules:
-            if "public" in str(rule):
-                grammar_str += "public "
-            grammar_str += f"{str(rule.lhs)} = "
-            grammar_str += " | ".join(str(sym) for sym in rule.rhs)
-            grammar_str += ";\n"
 
-        # remove parentheses and commas
-        return grammar_str.replace("(", "").replace(")", "").replace(",", "")
+def _reachable_masks(successors: List[int]) -> List[int]:
+    """
+    per node (given the bitmasks of its successors): the bitmask of the nodes reachable from it, itself included.
+    the strongly connected components are found with an iterative Tarjan search, which finishes a component only
+    after all components it reaches, so each closure is the union of its successors' finished closures
+    (one OR per edge instead of one search per node, which matters for the many symbols of normalized grammars)
+    """
+    n = len(successors)
+    closure, index, low = [0] * n, [-1] * n, [0] * n
+    stack, on_stack, counter = [], [False] * n, 0
+    for root in range(n):
+        if index[root] >= 0:
+            continue
+        work = [(root, successors[root])]  # (node, successors not visited yet)
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        while work:
+            node, pending = work[-1]
+            if pending:
+                bit = pending & -pending
+                work[-1] = (node, pending ^ bit)
+                child = bit.bit_length() - 1
+                if index[child] < 0:
+                    index[child] = low[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack[child] = True
+                    work.append((child, successors[child]))
+                elif on_stack[child]:
+                    low[node] = min(low[node], index[child])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:  # node is the root of a finished component
+                members, mask = [], 0
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    members.append(member)
+                    mask |= 1 << member
+                    if member == node:
+                        break
+                reached = mask
+                for member in members:
+                    pending = successors[member] & ~mask
+                    while pending:
+                        bit = pending & -pending
+                        pending ^= bit
+                        reached |= closure[bit.bit_length() - 1]
+                for member in members:
+                    closure[member] = reached
+    return closure
+
+
+def _is_epsilon_symbol(symbol: Symbol) -> bool:
+    """the empty word of $A = ; and SRGS's special rule $NULL"""
+    return symbol.symbol == "" if symbol.terminal else symbol.symbol == "NULL"
+
+
+def _remove_epsilon_rules(rules: list) -> list:
+    """for rules of at most two symbols (after binarisation), so there are at most four variants per rule"""
+    nullable = set()
+    changed = True
+    while changed:
+        changed = False
+        for r in rules:
+            if r.lhs not in nullable and all(_is_epsilon_symbol(s) or s in nullable for s in r.rhs):
+                nullable.add(r.lhs)
+                changed = True
+    result = []
+    for r in rules:
+        rhs = [s for s in r.rhs if not _is_epsilon_symbol(s)]
+        optional = [i for i, s in enumerate(rhs) if s in nullable]
+        for dropped in itertools.product((False, True), repeat=len(optional)):
+            removed = {i for i, drop in zip(optional, dropped) if drop}
+            variant = [s for i, s in enumerate(rhs) if i not in removed]
+            if variant and variant != [r.lhs]:
+                result.append(GrammarRule(r.lhs, variant, r.weight))
+    return result
+
+
+def _remove_unit_rules(rules: list) -> list:
+    """
+    replaces $A = $B; by A = x for every other rule B = x of each B reachable through unary rules,
+    following the shortest chain, with the weights multiplied along it
+    """
+    units, others = {}, {}
+    for r in rules:
+        if len(r.rhs) == 1 and not r.rhs[0].terminal:
+            if r.rhs[0] != r.lhs:
+                units.setdefault(r.lhs, []).append(r)
+        else:
+            others.setdefault(r.lhs, []).append(r)
+    result = [r for rules_of_lhs in others.values() for r in rules_of_lhs]
+    for top in units:
+        reached = {top: 1.0}
+        frontier = [top]
+        while frontier:
+            next_frontier = []
+            for symbol in frontier:
+                for r in units.get(symbol, ()):
+                    child = r.rhs[0]
+                    if child not in reached:
+                        reached[child] = reached[symbol] * r.weight
+                        next_frontier.append(child)
+            frontier = next_frontier
+        for child, weight in reached.items():
+            if child != top:
+                result.extend(GrammarRule(top, r.rhs, weight * r.weight) for r in others.get(child, ()))
+    return result
+
+
+def _merge_duplicate_rules(rules: list) -> list:
+    """one rule per left- and right-hand side, with the best weight, in the order of first appearance"""
+    merged = {}
+    for r in rules:
+        key = (r.lhs, tuple(r.rhs))
+        if key not in merged or r.weight > merged[key].weight:
+            merged[key] = r
+    return list(merged.values())
+
+
+COMPILED_GRAMMAR_VERSION = 6  # bump whenever the layout of Grammar.to_compiled() changes
+_RUNTIME_STATE = ("chart_cache", "chart_cache_lock")  # attributes that are not part of the grammar itself
+# the precomputed tables that the compiled form stores as they are
+_CHART_TABLES = ("lexical_masks", "lexical_trie", "right_masks", "parent_masks", "lexical_scores", "binary_scores",
+                 "has_unary_rules", "unary_rules", "unary_closure", "unary_chains", "unary_chain_scores",
+                 "unary_components", "left_closure")
+
+
+def grammar_cache_dir() -> str:
+    """
+    the directory for compiled grammars: a private directory in the user's cache directory.
+    unpickling runs code, so compiled grammars are never read from a place that other users can write to,
+    like the directory of a shared grammar file. returns None if there is no such directory.
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.expanduser("~/.cache")
+    directory = os.path.join(base, "srgs-grammars")
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        info = os.stat(directory)
+    except OSError:
+        return None
+    if hasattr(os, "getuid") and (info.st_uid != os.getuid() or info.st_mode & 0o022):
+        return None  # someone else could put a compiled grammar there
+    return directory
+
+
+def load_grammar(path: str, use_cache: bool = True, normalize: bool = False, cache_dir: str = None) -> Grammar:
+    """
+    loads the SRGS grammar at path. the compiled grammar is cached in cache_dir (grammar_cache_dir() by default),
+    keyed by the hash of the source, so later loads of an unchanged file are a single bulk read.
+    normalize=True converts the grammar to relaxed CNF (see Grammar.normalize_to_relaxedCNF) before compiling;
+    that version, with its normalization_record, is cached separately.
+    """
+    with open(path, "rb") as f:
+        source = f.read()
+    source_hash = hashlib.sha256(source).hexdigest()
+    cache_dir = (cache_dir or grammar_cache_dir()) if use_cache else None
+    cache_path = cache_dir and os.path.join(cache_dir, source_hash + (".normalized.compiled" if normalize else ".compiled"))
+    if cache_path:
+        try:
+            with open(cache_path, "rb") as f:
+                compiled = pickle.loads(f.read())
+            if compiled.get("version") == COMPILED_GRAMMAR_VERSION and compiled.get("source_hash") == source_hash:
+                return Grammar.from_compiled(compiled)
+        except Exception:
+            pass  # missing, truncated or stale cache: fall back to the source
+    grammar = Grammar(source.decode("utf-8").splitlines())
+    if normalize:
+        grammar.normalize_to_relaxedCNF()
+    if cache_path:
+        try:
+            temporary_path = "{}.{}.tmp".format(cache_path, os.getpid())
+            with open(temporary_path, "wb") as f:
+                pickle.dump(grammar.to_compiled(source_hash), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, cache_path)  # atomic, so concurrent loaders never see half a file
+        except OSError:
+            pass  # read-only location: just don't cache
+    return grammar
+
+
+class GrammarRegistry:
+    """
+    holds any number of independent grammars by name (e.g. one per language or domain),
+    so that a long-running process can serve all of them
+    """
+    grammars: Mapping[str, Grammar]
+
+    def __init__(self):
+        self.grammars = {}
+
+    def register(self, name: str, grammar: Grammar) -> Grammar:
+        self.grammars[name] = grammar
+        return grammar
+
+    def load(self, name: str, path: str, use_cache: bool = True, normalize: bool = False) -> Grammar:
+        return self.register(name, load_grammar(path, use_cache, normalize))
+
+    def remove(self, name: str):
+        self.grammars.pop(name).clear_chart_cache()  # the charts refer to the grammar
+
+    def __getitem__(self, name: str) -> Grammar:
+        return self.grammars[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.grammars
+
+    def __iter__(self):
+        return iter(self.grammars)
+
+    def __len__(self):
+        return len(self.grammars)
 
+    def memory_usage(self) -> Mapping[str, int]:
+        """approximate bytes per registered grammar"""
+        return {name: grammar.memory_usage() for name, grammar in self.grammars.items()}
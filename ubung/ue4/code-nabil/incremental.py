@@ -0,0 +1,65 @@
+from grammar import *
+from parse import *
+from parser import *  # type: ignore
+from parser import _combine, _iter_bits  # type: ignore
+
+
+class IncrementalParser:
+    """
+    CKY parser for input that arrives word by word (e.g. from a speech recogniser).
+    push() fills one new chart column, which only needs the columns left of it,
+    so each word costs O(n²) cell combinations instead of a fresh O(n³) fill.
+    """
+    grammar: Grammar
+    words: list
+    cells: list  # the CKY chart, cells[start][end] as in fill_chart
+    prefix_cells: list  # prefix_cells[start]: the symbols that can produce words[start:] followed by more words
+
+    def __init__(self, grammar: Grammar):
+        self.grammar = grammar
+        self.words = []
+        self.cells = [[0]]
+        self.prefix_cells = []
+
+    def push(self, word: str):
+        self.words.append(word)
+        end = len(self.words)
+        for row in self.cells:
+            row.append(0)
+        self.cells.append([0] * (end + 1))
+        fill_column(self.cells, self.words, end, self.grammar)
+        self._fill_prefix_column(end)
+
+    def _fill_prefix_column(self, end: int):
+        """
+        A can start with words[start:end] if it produces them completely, if it has a multi-word entry that
+        starts with them, or if A = B C with B producing words[start:mid] and C starting with words[mid:end],
+        or if such an A is a left corner
+        """
+        left_closure, trie = self.grammar.left_closure, self.grammar.lexical_trie
+        self.prefix_cells = [0] * end
+        for start in range(end - 1, -1, -1):
+            cell = self.cells[start][end]
+            if trie and end - start < trie.max_length:  # the start of a multi-word entry
+                cell |= trie.prefix_mask(self.words, start, end)
+            for mid in range(start + 1, end):
+                cell |= _combine(self.cells[start][mid], self.prefix_cells[mid], self.grammar)
+            closed = cell
+            for symbol_id in _iter_bits(cell):
+                closed |= left_closure[symbol_id]
+            self.prefix_cells[start] = closed
+
+    def is_viable(self) -> bool:
+        """can the input so far still be continued to a sentence of the language?"""
+        if not self.words:
+            return True
+        return bool(self.prefix_cells[0] >> self.grammar.symbol_ids[self.grammar.start_symbol] & 1)
+
+    def is_complete(self) -> bool:
+        """is the input so far a sentence of the language?"""
+        return bool(self.words) and \
+            bool(self.cells[0][len(self.words)] >> self.grammar.symbol_ids[self.grammar.start_symbol] & 1)
+
+    def chart(self) -> Chart:
+        """a Chart of the current input (for trees, span queries, ...), sharing the cells filled so far"""
+        return Chart(self.words, self.grammar, [row[:] for row in self.cells])
@@ -1,6 +1,12 @@
+import math
+import sys
+import time
+
 from grammar import *
 from parse import *
 from parser import * # type: ignore
+from incremental import IncrementalParser
+import stats
 
 # H 4 (Testing)
 
@@ -45,10 +51,31 @@ def test_normalization():
     non_normalized_grammar = Grammar(non_normalized_grammar_str.split("\n"))
 
     # Normalize the grammar
-    non_normalized_grammar.normalize_to_relaxedCNF()
+    report = non_normalized_grammar.normalize_to_relaxedCNF()
 
     # Print the normalized grammar
     print(non_normalized_grammar)
+    print(report)
+
+    # n-ary rules and terminals inside rules: CKY on the normalized grammar, with the normalization undone,
+    # finds the same trees as Earley on the original rules
+    nary_grammar_str = non_normalized_grammar_str + """
+$NP = $Det big $N;
+$VP = $V $NP with $NP;
+$VP = saw $Det big $N;
+"""
+    original = Grammar(nary_grammar_str.split("\n"))
+    normalized = Grammar(nary_grammar_str.split("\n"))
+    print(normalized.normalize_to_relaxedCNF())
+    assert normalized.is_relaxedCNF() and not original.is_relaxedCNF()
+    assert Grammar(repr(normalized).split("\n")).rules == normalized.rules
+    words = ["I", "saw", "the", "big", "duck", "with", "a", "telescope"]
+    record = normalized.normalization_record
+    cky_trees = sorted(repr(tree.remove_normalized_nodes(record)) for tree in parse(words, normalized))
+    earley_trees = sorted(repr(tree.remove_normalized_nodes(record)) for tree in parse(words, original, "earley"))
+    assert cky_trees == earley_trees, (cky_trees, earley_trees)
+    for tree in cky_trees:
+        print(tree)
 
 # Test removal of extra nodes introduced during normalization
 def test_extra_node_removal():
@@ -88,14 +115,160 @@ def test_extra_node_removal():
     print("Parse Tree after extra node removal:")
     print(parse_tree)
 
-# Run the tests
+# Test Viterbi and k-best parsing with a weighted grammar
+def test_viterbi():
+    # Prefer attaching the PP to the verb phrase
+    weighted_grammar_str = non_normalized_grammar_str.replace("$VP = $VP $PP;", "$VP = /0.6/ $VP $PP;") \
+                                                     .replace("$NP = $NP $PP;", "$NP = /0.4/ $NP $PP;")
+    weighted_grammar = Grammar(weighted_grammar_str.split("\n"))
+
+    words = ["I", "saw", "the", "duck", "with", "a", "telescope"]
+    best, score = viterbi_parse(words, weighted_grammar)
+    print("Best parse ({:.3f}):".format(score), best)
+    for score, tree in k_best_parses(words, weighted_grammar, 2):
+        print("{:.3f}".format(score), tree)
+
+# Test parsing with unary rules (allowed in relaxed CNF), including a unary cycle
+def test_unary_rules():
+    unary_grammar_str = non_normalized_grammar_str + """
+$NP = $N;
+$VP = $V;
+$N = ducks;
+$V = ducks;
+$NP = $Nominal;
+$Nominal = $NP;
+"""
+    unary_grammar = Grammar(unary_grammar_str.split("\n"))
+
+    for sentence in ["I saw ducks", "I ducks", "ducks saw the duck with ducks"]:
+        words = sentence.split(" ")
+        print(sentence, "->", count_parses(words, unary_grammar), "parse(s)")
+        for pars in parse(words, unary_grammar):
+            print(pars)
+
+    # CKY and Earley find the same trees with unary cycles: the trees of $NP below $S = $Nominal $VP
+    # may not go through $Nominal again, and those of $A below $B = $A not through $B (the rule $B = x;
+    # is there twice, which must not double the trees)
+    cycle_grammar_strs = ["""
+#ABNF V1.0 utf-8;
+language en;
+public $S = $NP $VP;
+$S = $Nominal $VP;
+$NP = $Det $N;
+$NP = $Nominal;
+$Nominal = $NP;
+$VP = saw;
+$Det = the;
+$N = duck;
+""", """
+#ABNF V1.0 utf-8;
+language en;
+public $S = $A $B;
+$S = $B $B;
+$A = $B;
+$B = $A;
+$B = x;
+$B = x;
+"""]
+    for cycle_grammar_str, words in zip(cycle_grammar_strs, [["the", "duck", "saw"], ["x", "x"]]):
+        cycle_grammar = Grammar(cycle_grammar_str.split("\n"))
+        cky_trees = sorted(repr(tree) for tree in parse(words, cycle_grammar))
+        earley_trees = sorted(repr(tree) for tree in parse(words, cycle_grammar, "earley"))
+        assert cky_trees == earley_trees, (cky_trees, earley_trees)
+        print(" ".join(words), "->", len(earley_trees), "parse(s) with CKY and Earley")
+
+    # Two unary chains from $A down to $D are two parses, not one
+    diamond_grammar_str = """
+#ABNF V1.0 utf-8;
+language en;
+public $S = $A;
+$A = $B;
+$A = $C;
+$B = $D;
+$C = $D;
+$D = x;
+"""
+    diamond_grammar = Grammar(diamond_grammar_str.split("\n"))
+    assert count_parses(["x"], diamond_grammar) == len(parse(["x"], diamond_grammar, "earley")) == 2
+    for pars in parse(["x"], diamond_grammar):
+        print(pars)
+
+    # Viterbi takes the longer unary chain if it has the higher weight
+    weighted_unary_grammar_str = """
+#ABNF V1.0 utf-8;
+language en;
+public $S = $A $A;
+$A = /0.1/ $D;
+$A = /0.9/ $B;
+$B = /0.9/ $D;
+$D = x;
+"""
+    weighted_unary_grammar = Grammar(weighted_unary_grammar_str.split("\n"))
+    best, score = viterbi_parse(["x", "x"], weighted_unary_grammar)
+    assert abs(score - 2 * math.log(0.81)) < 1e-9, score
+    print("Best parse ({:.3f}):".format(score), best)
+    k_best = k_best_parses(["x", "x"], weighted_unary_grammar, 10)
+    assert len(k_best) == count_parses(["x", "x"], weighted_unary_grammar) == 4
+    for score, tree in k_best:
+        print("{:.3f}".format(score), tree)
+
+# Test word-by-word parsing
+def test_incremental():
+    grammar = Grammar(non_normalized_grammar_str.split("\n"))
+    incremental_parser = IncrementalParser(grammar)
+    for word in ["I", "saw", "the", "duck", "with", "a", "telescope", "the"]:
+        incremental_parser.push(word)
+        print("{:<10} viable: {:<5} complete: {}".format(
+            word, str(incremental_parser.is_viable()), incremental_parser.is_complete()))
+
+# Test robust parsing of sentences outside the language
+def test_partial_parsing():
+    grammar = Grammar(non_normalized_grammar_str.split("\n") + ["$NP = $N;", "$NP = $Nominal;", "$Nominal = $NP;"])
+    words = "I saw the duck with a telescope and a cat".split(" ")
+    for unknown_word in [None, "$N"]:
+        grammar.set_unknown_word(unknown_word)
+        print("unknown words as", unknown_word)
+        for start, end, tree in partial_parse(words, grammar):
+            print("  ", " ".join(words[start:end]), "->", tree)
+
+# Test that several grammars in one process don't share their rules
+def test_multiple_grammars():
+    registry = GrammarRegistry()
+    words = ["I", "saw", "the", "duck", "with", "a", "telescope"]
+    rule_count = len(non_normalized_grammar_str.strip().split("\n")) - 2  # without header and language line
+    for i in range(5):
+        name = "telescope-{}".format(i)
+        grammar = registry.register(name, Grammar(non_normalized_grammar_str.split("\n")))
+        start = time.perf_counter()
+        assert is_in_language(words, grammar)
+        elapsed = time.perf_counter() - start
+        assert len(grammar.rules) == rule_count, "rules leak between grammars: {}".format(len(grammar.rules))
+        print("{}: {} rules, CKY {:.6f}s".format(name, len(grammar.rules), elapsed))
+    print({name: "{} bytes".format(size) for name, size in registry.memory_usage().items()})
+
+# Run the tests; with --profile, print what the parser did for every sentence at the end
 if __name__ == "__main__":
+    profile = stats.enable() if "--profile" in sys.argv[1:] else None
     print("Testing Parsing:")
     test_parsing()
     print("\nTesting Normalization:")
     test_normalization()
     print("\nTesting Extra Node Removal:")
     test_extra_node_removal()
+    print("\nTesting Viterbi Parsing:")
+    test_viterbi()
+    print("\nTesting Unary Rules:")
+    test_unary_rules()
+    print("\nTesting Incremental Parsing:")
+    test_incremental()
+    print("\nTesting Partial Parsing:")
+    test_partial_parsing()
+    print("\nTesting Multiple Grammars:")
+    test_multiple_grammars()
+    if profile:
+        print("\nProfile:")
+        print(profile.report())
+        print(profile.heatmaps())
 
 
 """
@@ -107,19 +280,85 @@ Testing Parsing:
 Testing Normalization:
 #ABNF V1.0 utf-8;
 language en;
-$S = $NP $VP;
-$NP = I | $NP $PP | $Det $N;
-$Det = her | my | a | the;
-$N = telescope | saw | duck;
-$VP = $VP $PP | $V $NP;
-$V = saw | duck;
+public $S = $NP $VP;
+$NP = I;
+$NP = $Det $N;
+$Det = the;
+$Det = a;
+$Det = my;
+$Det = her;
+$N = duck;
+$N = telescope;
+$VP = $VP $PP;
+$VP = $V $NP;
+$V = saw;
+$N = saw;
+$V = duck;
+$NP = $NP $PP;
 $PP = $P $NP;
 $P = with;
-
+{'before': {'nonterminals': 8, 'terminals': 9, 'rules': 17, 'rhs_symbols': 23}, 'after': {'nonterminals': 8, 'terminals': 9, 'rules': 17, 'rhs_symbols': 23}}
+{'before': {'nonterminals': 8, 'terminals': 10, 'rules': 20, 'rhs_symbols': 34}, 'after': {'nonterminals': 15, 'terminals': 10, 'rules': 27, 'rhs_symbols': 40}}
+[$S [$NP I] [$VP [$V saw] [$NP [$Det the] big [$N duck]] with [$NP [$Det a] [$N telescope]]]]
+[$S [$NP I] [$VP [$V saw] [$NP [$NP [$Det the] big [$N duck]] [$PP [$P with] [$NP [$Det a] [$N telescope]]]]]]
+[$S [$NP I] [$VP [$VP [$V saw] [$NP [$Det the] big [$N duck]]] [$PP [$P with] [$NP [$Det a] [$N telescope]]]]]
+[$S [$NP I] [$VP [$VP saw [$Det the] big [$N duck]] [$PP [$P with] [$NP [$Det a] [$N telescope]]]]]
 
 Testing Extra Node Removal:
 Parse Tree before extra node removal:
 [$S [$NP [$Det the] [$N duck] [$NP_NT [$Det the] [$N telescope]]] [$VP [$V saw] [$NP [$Det the] [$N duck]] [$PP [$P with] [$NP [$Det a] [$N telescope]]]]]
 Parse Tree after extra node removal:
-[$S [$NP the duck [$NP_NT the telescope]] [$VP saw [$NP the duck] [$PP with [$NP a telescope]]]]
-"""
\ No newline at end of file
+[$S [$NP [$Det the] [$N duck] [$Det the] [$N telescope]] [$VP [$V saw] [$NP [$Det the] [$N duck]] [$PP [$P with] [$NP [$Det a] [$N telescope]]]]]
+
+Testing Viterbi Parsing:
+Best parse (-0.511): [$S [$S [$NP I] [$VP [$VP [$V saw] [$NP [$Det the] [$N duck]]] [$PP [$P with] [$NP [$Det a] [$N telescope]]]]]]
+-0.511 [$S [$S [$NP I] [$VP [$VP [$V saw] [$NP [$Det the] [$N duck]]] [$PP [$P with] [$NP [$Det a] [$N telescope]]]]]]
+-0.916 [$S [$S [$NP I] [$VP [$V saw] [$NP [$NP [$Det the] [$N duck]] [$PP [$P with] [$NP [$Det a] [$N telescope]]]]]]]
+
+Testing Unary Rules:
+I saw ducks -> 1 parse(s)
+[$S [$S [$NP I] [$VP [$V saw] [$NP [$N ducks]]]]]
+I ducks -> 1 parse(s)
+[$S [$S [$NP I] [$VP [$V ducks]]]]
+ducks saw the duck with ducks -> 2 parse(s)
+[$S [$S [$NP [$N ducks]] [$VP [$V saw] [$NP [$NP [$Det the] [$N duck]] [$PP [$P with] [$NP [$N ducks]]]]]]]
+[$S [$S [$NP [$N ducks]] [$VP [$VP [$V saw] [$NP [$Det the] [$N duck]]] [$PP [$P with] [$NP [$N ducks]]]]]]
+the duck saw -> 2 parse(s) with CKY and Earley
+x x -> 2 parse(s) with CKY and Earley
+[$S [$S [$A [$B [$D x]]]]]
+[$S [$S [$A [$C [$D x]]]]]
+Best parse (-0.421): [$S [$S [$A [$B [$D x]]] [$A [$B [$D x]]]]]
+-0.421 [$S [$S [$A [$B [$D x]]] [$A [$B [$D x]]]]]
+-2.513 [$S [$S [$A [$B [$D x]]] [$A [$D x]]]]
+-2.513 [$S [$S [$A [$D x]] [$A [$B [$D x]]]]]
+-4.605 [$S [$S [$A [$D x]] [$A [$D x]]]]
+
+Testing Incremental Parsing:
+I          viable: True  complete: False
+saw        viable: True  complete: False
+the        viable: True  complete: False
+duck       viable: True  complete: True
+with       viable: True  complete: False
+a          viable: True  complete: False
+telescope  viable: True  complete: True
+the        viable: False complete: False
+
+Testing Partial Parsing:
+unknown words as None
+   I saw the duck with a telescope -> [$S [$NP I] [$VP [$V saw] [$NP [$NP [$Det the] [$N duck]] [$PP [$P with] [$NP [$Det a] [$N telescope]]]]]]
+   and -> and
+   a -> [$Det a]
+   cat -> cat
+unknown words as $N
+   I saw the duck with a telescope -> [$S [$NP I] [$VP [$V saw] [$NP [$NP [$Det the] [$N duck]] [$PP [$P with] [$NP [$Det a] [$N telescope]]]]]]
+   and -> [$NP [$N and]]
+   a cat -> [$NP [$Det a] [$N cat]]
+
+Testing Multiple Grammars:
+telescope-0: 17 rules, CKY 0.000087s
+telescope-1: 17 rules, CKY 0.000087s
+telescope-2: 17 rules, CKY 0.000086s
+telescope-3: 17 rules, CKY 0.000084s
+telescope-4: 17 rules, CKY 0.000082s
+{'telescope-0': '24774 bytes', 'telescope-1': '24774 bytes', 'telescope-2': '24774 bytes', 'telescope-3': '24774 bytes', 'telescope-4': '24774 bytes'}
+"""
@@ -1,12 +1,18 @@
-from grammar import Symbol
+import contextlib
+import gc
+import io
+import itertools
+import json
+
+from grammar import Symbol, is_synthetic_symbol
 from operator import itemgetter
 
-_node_id = 0  # counter to ensure that _next_node_id() will create unique IDs
+_node_ids = itertools.count(1)  # source of _next_node_id(); next() on a count is atomic, so ids stay unique across threads
+# an id identifies a node instance; a subtree shared between several parse trees keeps its id,
+# which is still unique within each tree because a node covers a single span of it
 
 def _next_node_id():
-    global _node_id
-    _node_id += 1
-    return _node_id
+    return next(_node_ids)
 
 class ParseNode:
     """a parse node consists of the constituent symbol (for non-terminals) or the terminal symbol"""
@@ -20,65 +26,354 @@ class ParseNode:
         assert symbol.terminal == (len(productions) == 0), "a terminal can't produce anything {} !".format(symbol)
         self.productions = productions
 
+    def _write_dot_productions(self, out):
+        """the edges below this node in depth-first order, with an explicit stack instead of recursion"""
+        stack = [(self, iter(self.productions))]
+        while stack:
+            node, productions = stack[-1]
+            p = next(productions, None)
+            if p is None:
+                stack.pop()
+                continue
+            out.write("{} [label=\"{}\"];\n{} -> {};\n".format(node.id, node.symbol.symbol, node.id, p.id))
+            stack.append((p, iter(p.productions)))
+
     def _to_dot_productions(self):
-        output = ""
-        for p in self.productions:
-            output += str(self.id) + " [label=\"" + self.symbol.symbol + "\"];\n"
-            output += str(self.id) + " -> " + str(p.id) + ";\n"
-            output += p._to_dot_productions()
-        return output
+        output = io.StringIO()
+        self._write_dot_productions(output)
+        return output.getvalue()
+
+    def iter_nodes(self):
+        """all nodes of the tree in depth-first, left-to-right order"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.productions))
 
     def collect_terminals(self):
-        if self.symbol.terminal:
-            return [(self.id, self.symbol)]
-        else:
-            return sum([p.collect_terminals() for p in self.productions], start=[])
+        return [(node.id, node.symbol) for node in self.iter_nodes() if node.symbol.terminal]
+
+    def write_bracketed(self, out):
+        """writes the tree as [$S [$NP I] ...], the same as repr(), without recursion"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):  # a closing bracket or separator
+                out.write(node)
+            elif node.productions:
+                out.write("[" + repr(node.symbol) + " ")
+                stack.append("]")
+                for i in range(len(node.productions) - 1, -1, -1):
+                    stack.append(node.productions[i])
+                    if i:
+                        stack.append(" ")
+            else:
+                out.write(repr(node.symbol))
+
+    def write_json(self, out):
+        """
+        writes the tree as compact JSON: a nonterminal node is a list of its symbol and its children,
+        a terminal is its word, e.g. ["$S",["$NP","I"],...]
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                out.write(node)
+            elif node.productions:
+                out.write("[" + json.dumps(repr(node.symbol), ensure_ascii=False))
+                stack.append("]")
+                for p in reversed(node.productions):
+                    stack.append(p)
+                    stack.append(",")
+            else:
+                out.write(json.dumps(node.symbol.symbol, ensure_ascii=False))
+
+    def to_json(self) -> str:
+        output = io.StringIO()
+        self.write_json(output)
+        return output.getvalue()
+
+    @classmethod
+    def from_json(cls, text: str):
+        """reads write_json() output back; the root is an instance of cls, e.g. ParseTree.from_json(...)"""
+        return _build_node(cls, json.loads(text))
+
+    @classmethod
+    def from_bracketed(cls, text: str):
+        """reads write_bracketed() (or repr()) output back; words must not contain spaces or brackets"""
+        tokens = text.replace("[", " [ ").replace("]", " ] ").split()
+        stack = [[]]  # the open nodes: symbol name first, then their finished children
+        with _gc_paused():
+            for token in tokens:
+                if token == "[":
+                    stack.append([])
+                elif token == "]":
+                    name, *productions = stack.pop()
+                    stack[-1].append((cls if len(stack) == 1 else ParseNode)(Symbol(name), productions))
+                elif stack[-1] or len(stack) == 1:  # a word
+                    stack[-1].append((cls if len(stack) == 1 else ParseNode)(Symbol(token)))
+                else:  # the symbol of the node that was just opened
+                    stack[-1].append(token)
+        assert len(stack) == 1 and len(stack[0]) == 1, "not a single bracketed tree: {}".format(text[:80])
+        return stack[0][0]
 
     def __repr__(self):
-        return "[" + repr(self.symbol) + " " + " ".join(map(repr, self.productions)) + "]" if self.productions else repr(self.symbol)
+        output = io.StringIO()
+        self.write_bracketed(output)
+        return output.getvalue()
     
     # H 4.1.4
-    def remove_normalized_nodes(self):
-        """Recursively removes extra nodes introduced during normalization."""
-        self.productions = [p.remove_normalized_nodes() for p in self.productions]
-        # If there is only one production, return it
-        if len(self.productions) == 1:
-            return self.productions[0]
-        return self
+    def remove_normalized_nodes(self, synthetic=None):
+        """Removes the nodes of the symbols that normalization introduced and moves their children up
+        into the parent, which restores the n-ary rules of the original grammar; all other nodes
+        (preterminals too) stay. synthetic is the set of those symbols, e.g. Grammar.normalization_record;
+        by default the symbols named the way normalize_to_relaxedCNF names them.
+        Nodes may be shared between parse trees, so changed nodes are copied instead of modified."""
+        return _remove_synthetic_nodes(self, synthetic)
 
 
 class ParseTree(ParseNode):
     """a parse tree is just a regular node that also knows how to draw itself"""
 
     def to_dot(self):
-        output = "digraph parsetree {\n"
-        output += self._to_dot_terminals_subgraph()
-        output += "rankdir=\"TB\";\n" + \
-                  str(self.id) +";\n" \
-                  "node [shape=\"none\"]\n" \
-                  "edge [style=\"solid\"];\n"
-        output += self._to_dot_productions()
-        output += "}"
-        return output
+        output = io.StringIO()
+        self.write_dot(output)
+        return output.getvalue()
 
-    def _to_dot_terminals_subgraph(self):
+    def write_dot(self, out):
+        """streams the DOT graph to a file-like object, e.g. an open file, without building it in memory"""
+        out.write("digraph parsetree {\n")
+        self._write_dot_terminals_subgraph(out)
+        out.write("rankdir=\"TB\";\n" +
+                  str(self.id) + ";\n"
+                  "node [shape=\"none\"]\n"
+                  "edge [style=\"solid\"];\n")
+        self._write_dot_productions(out)
+        out.write("}")
+
+    def _write_dot_terminals_subgraph(self, out):
         terminals = self.collect_terminals()
-        output = "{\n" \
-                 "rankdir=\"LR\";\n" \
-                 "node [shape=\"box\"];\n" \
-                 "edge [style=\"invis\"];\n" \
-                 "rank=\"same\";\n"
-        for id,s in terminals:
-            output += str(id) + " [label=\"" + str(s.symbol) + "\"];\n"
-        output += " -> ".join(map(str, map(itemgetter(0), terminals)))
-        output += ";\n}\n"
-        return output
+        out.write("{\n"
+                  "rankdir=\"LR\";\n"
+                  "node [shape=\"box\"];\n"
+                  "edge [style=\"invis\"];\n"
+                  "rank=\"same\";\n")
+        for id, s in terminals:
+            out.write(str(id) + " [label=\"" + str(s.symbol) + "\"];\n")
+        out.write(" -> ".join(map(str, map(itemgetter(0), terminals))))
+        out.write(";\n}\n")
+
+    def _to_dot_terminals_subgraph(self):
+        output = io.StringIO()
+        self._write_dot_terminals_subgraph(output)
+        return output.getvalue()
     
     # H 4.1.4
-    def remove_normalized_nodes(self):
-        """Removes extra nodes introduced during normalization from the root."""
-        self.productions = [p.remove_normalized_nodes() for p in self.productions]
+    def remove_normalized_nodes(self, synthetic=None):
+        """Removes extra nodes introduced during normalization below the root, which is changed in place."""
+        self.productions = _remove_synthetic_nodes(self, synthetic).productions
         # If there is only one production, return it
         if len(self.productions) == 1:
             return self.productions[0]
         return self
+
+
+def _remove_synthetic_nodes(root: ParseNode, synthetic) -> ParseNode:
+    """
+    one bottom-up pass with an explicit stack, so long right-branching chains of synthetic symbols
+    cannot overflow the stack. every node is visited once: a synthetic node is flattened into the
+    nearest real node above it and never gets a copy of its own.
+    """
+    is_synthetic = synthetic.__contains__ if synthetic is not None else is_synthetic_symbol
+    result = {}  # map from id(node) to the node that replaces it
+    stack = [(root, None)]  # (node, None) before its children are done, (node, its real children) after
+    while stack:
+        node, children = stack.pop()
+        if id(node) in result:
+            continue
+        if children is None:
+            children = _real_children(node, is_synthetic)
+            stack.append((node, children))
+            stack.extend((child, None) for child in children if id(child) not in result)
+            continue
+        productions = [result[id(child)] for child in children]
+        unchanged = len(productions) == len(node.productions) and \
+            all(new is old for new, old in zip(productions, node.productions))
+        result[id(node)] = node if unchanged else ParseNode(node.symbol, productions)
+    return result[id(root)]
+
+
+def _real_children(node, is_synthetic) -> list:
+    """the children of node, with every synthetic child replaced by its own real children, left to right"""
+    children = []
+    stack = list(reversed(node.productions))
+    while stack:
+        child = stack.pop()
+        if is_synthetic(child.symbol):
+            stack.extend(reversed(child.productions))
+        else:
+            children.append(child)
+    return children
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """
+    pauses the cyclic garbage collector while a large tree is read: parse trees have no reference cycles,
+    but every few hundred new nodes the collector would rescan the whole growing tree
+    """
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def _build_node(cls, data):
+    """
+    builds nodes from nested [symbol, child, ...] lists and word strings (the JSON form),
+    bottom-up with an explicit stack; the root is an instance of cls
+    """
+    built = []  # finished nodes, in the order their parents expect them
+    stack = [(data, False)]
+    with _gc_paused():
+        while stack:
+            item, expanded = stack.pop()
+            name, children = (item, []) if isinstance(item, str) else (item[0], item[1:])
+            if not expanded and children:
+                stack.append((item, True))
+                stack.extend((child, False) for child in reversed(children))
+                continue
+            productions = built[len(built) - len(children):]
+            del built[len(built) - len(children):]
+            built.append((cls if not stack else ParseNode)(Symbol(name), productions))
+    return built[0]
+
+
+def lexical_node(symbol: Symbol, words: list, start: int, end: int) -> ParseNode:
+    """the node for a lexical entry symbol = words[start:end]; most entries are a single word"""
+    return ParseNode(symbol, [ParseNode(Symbol(word)) for word in words[start:end]])
+
+
+def unary_chain_node(grammar, symbol_id: int, child_id: int, tree: ParseNode) -> ParseNode:
+    """puts the node for symbol on top of tree (rooted in child), with the nodes of the unary chain in between"""
+    for link in reversed(grammar.unary_chains[symbol_id][child_id][:-1]):
+        tree = ParseNode(grammar.nonterminals[link], [tree])
+    return ParseNode(grammar.nonterminals[symbol_id], [tree])
+
+
+def unary_visited(grammar, visited: int, symbol_id: int, child_id: int) -> int:
+    """
+    the symbols that the derivation of child below a unary rule symbol -> child must not use again over
+    the same span: symbol and those visited above it, as far as they are in a unary cycle with child
+    (no other symbol can come back, so outside of cycles this is 0 and the derivations are shared).
+    inside a cycle the derivations are those of its paths, whose number grows quickly with its size.
+    """
+    return (visited | 1 << symbol_id) & grammar.unary_components[child_id]
+
+
+class ParseForest:
+    """
+    packed parse forest: one item per (start, end, symbol id) that can take part in a full parse,
+    each with the list of its backpointers, which are one of
+      ()                                 the symbol produces the words[start:end] directly (a lexical entry)
+      (mid, left id, right id)           a binary rule symbol -> left right, split at mid
+      (child id,)                        a unary rule symbol -> child over the same span
+    a unary rule may not lead back to a symbol that is already above it over the same span,
+    so the derivations of an item below a unary cycle depend on the bitmask of the symbols visited on
+    the way (see unary_visited); every derivation that does not run through a cycle is counted once.
+    """
+    words: list
+    grammar: object  # the Grammar the forest was built with
+    items: dict  # map from (start, end, symbol id) to the list of backpointers
+    root: tuple  # (0, len(words), start symbol id), or None if the words are not in the language
+
+    def __init__(self, words: list, grammar, items: dict, root):
+        self.words, self.grammar, self.items, self.root = words, grammar, items, root
+        self._count = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return self.root is not None
+
+    def count_parses(self) -> int:
+        """number of distinct parse trees, computed bottom-up over the items without building any tree"""
+        if self.root is None:
+            return 0
+        if self._count is None:
+            self._count = self._count_parses()
+        return self._count
+
+    def _count_parses(self) -> int:
+        total = {}  # map from (item, visited symbols) to its number of derivations
+        by_length = sorted(self.items, key=lambda item: item[1] - item[0])
+        for item in by_length:  # binary backpointers point to shorter spans, which are done first
+            self._count_derivations(item, 0, total)
+        return total[(self.root, 0)]
+
+    def _count_derivations(self, item, visited: int, total: dict) -> int:
+        if (item, visited) not in total:
+            start, end, symbol_id = item
+            count = 0
+            for backpointer in self.items[item]:
+                if len(backpointer) == 0:
+                    count += 1
+                elif len(backpointer) == 3:
+                    mid, left, right = backpointer
+                    count += total[((start, mid, left), 0)] * total[((mid, end, right), 0)]
+                elif not visited >> backpointer[0] & 1:
+                    child_visited = unary_visited(self.grammar, visited, symbol_id, backpointer[0])
+                    count += self._count_derivations((start, end, backpointer[0]), child_visited, total)
+            total[(item, visited)] = count
+        return total[(item, visited)]
+
+    def trees(self):
+        """
+        lazily yields the parse trees (as ParseNodes rooted in the start symbol) one at a time.
+        subtrees are derived once per item and shared between the yielded trees,
+        so don't modify the nodes in place.
+        """
+        if self.root is not None:
+            yield from self._trees(self.root, {})
+
+    def _subtrees(self, item, memo: dict, visited: int = 0):
+        """
+        yields the trees of item that don't use the visited symbols again (see unary_visited).
+        memo keeps one generator per item and the trees it has made so far; every reader replays
+        that list and only advances the shared generator once it has read all of it,
+        so an item is never derived further than the trees asked for so far need
+        """
+        if (item, visited) not in memo:
+            memo[(item, visited)] = [], self._trees(item, memo, visited)
+        made, generator = memo[(item, visited)]
+        i = 0
+        while True:
+            if i == len(made):
+                tree = next(generator, None)
+                if tree is None:
+                    return
+                made.append(tree)
+            yield made[i]
+            i += 1
+
+    def _trees(self, item, memo: dict, visited: int = 0):
+        start, end, symbol_id = item
+        symbol = self.grammar.nonterminals[symbol_id]
+        for backpointer in self.items[item]:
+            if len(backpointer) == 0:
+                yield lexical_node(symbol, self.words, start, end)
+            elif len(backpointer) == 3:
+                mid, left, right = backpointer
+                for lt in self._subtrees((start, mid, left), memo):
+                    for rt in self._subtrees((mid, end, right), memo):
+                        yield ParseNode(symbol, [lt, rt])
+            elif not visited >> backpointer[0] & 1:
+                child_visited = unary_visited(self.grammar, visited, symbol_id, backpointer[0])
+                for tree in self._subtrees((start, end, backpointer[0]), memo, child_visited):
+                    yield ParseNode(symbol, [tree])
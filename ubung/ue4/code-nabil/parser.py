@@ -1,92 +1,483 @@
+import heapq
+import math
+import time
+import weakref
+
+import earley
+import parse as parse_module
+import stats
 from grammar import *
 from parse import *
 
-# H 3.2
-def is_in_language(words: list, grammar: Grammar) -> bool:
-    # Initialize chart to store constituents that can generate substrings
+CHART_CACHE_SIZE = 1024  # number of sentences per grammar whose charts get_chart() keeps in Grammar.chart_cache
+_cached_grammars = weakref.WeakSet()  # the grammars that get_chart() has cached charts for, for clear_chart_cache()
+
+
+def _iter_bits(mask: int):
+    """yield the ids of all set bits of a chart cell"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def fill_chart(words: list, grammar: Grammar, counters: dict = None) -> list:
+    """
+    runs CKY over words and returns the chart; chart[start][end] is a bitmask
+    with bit i set if grammar.nonterminals[i] can produce words[start:end].
+    with counters (see stats.new_counters), the work of the CKY loops is counted into them as it is done.
+    """
     n = len(words)
-    chart = [[set() for _ in range(n + 1)] for _ in range(n + 1)]
+    chart = [[0] * (n + 1) for _ in range(n + 1)]
+    for end in range(1, n + 1):
+        fill_column(chart, words, end, grammar, counters)
+    return chart
 
-    # Initialize chart with lexical items (words)
-    for i in range(1, n + 1):
-        word = words[i - 1]
-        for rule in grammar.rule_map[(Symbol(word),)]:
-            chart[i - 1][i].add(rule.lhs)
 
-    # CKY algorithm for parsing
-    for length in range(2, n + 1):
-        for start in range(n - length + 1):
-            end = start + length
-            for mid in range(start + 1, end):
-                for rule in grammar.rules:
-                    if len(rule.rhs) == 2:  # Consider only binary rules
-                        left, right = rule.rhs
-                        if left in chart[start][mid] and right in chart[mid][end]:
-                            chart[start][end].add(rule.lhs)
+def fill_column(chart: list, words: list, end: int, grammar: Grammar, counters: dict = None):
+    """
+    fills all cells chart[start][end] of one column; only needs the columns left of it.
+    filling the chart column by column lets the incremental parser extend it word by word.
+    """
+    closure = grammar.unary_closure if grammar.has_unary_rules else None
 
-    # Check if the start symbol is in the last cell of the chart
-    return grammar.start_symbol in chart[0][n]
+    # Initialize the cell of the last word with its lexical items
+    cell = grammar.lexical_masks.get(words[end - 1], grammar.unknown_mask)
+    chart[end - 1][end] = _close(cell, closure) if closure and cell else cell
+    if counters is not None:
+        stats.count_cell(counters, grammar, cell, chart[end - 1][end])
 
-# H 4.1.1
-def parse(words: list, grammar: Grammar) -> list:
-    # Function to recursively build parse trees
-    def build_trees(chart, start, end, symbol):
-        # Base case: if only one word, return a parse node with the word as terminal
-        if end - start == 1:
-            return [ParseNode(symbol, [ParseNode(Symbol(words[start]))])]
-        
-        # Recursive case: build trees using binary rules
-        trees = []
+    # CKY algorithm: combine the symbols of two neighbouring cells via the precomputed masks,
+    # bottom-up, so chart[mid][end] is done before it is needed for a longer span
+    # multi-word lexical entries are looked up in the trie, only for spans up to the longest entry
+    trie = grammar.lexical_trie
+    for start in range(end - 2, -1, -1):
+        cell = trie.mask(words, start, end) if trie and end - start <= trie.max_length else 0
+        for mid in range(start + 1, end):
+            cell |= _combine(chart[start][mid], chart[mid][end], grammar, counters)
+        chart[start][end] = _close(cell, closure) if closure and cell else cell
+        if counters is not None:
+            counters["cells"] += 1
+            counters["filled_cells"] += bool(chart[start][end])
+            stats.count_cell(counters, grammar, cell, chart[start][end])
+
+
+def _combine(left_cell: int, right_cell: int, grammar: Grammar, counters: dict = None) -> int:
+    """the parents of all binary rules whose children are in the two cells"""
+    cell = 0
+    if right_cell:
+        right_masks, parent_masks = grammar.right_masks, grammar.parent_masks
+        for left in _iter_bits(left_cell):
+            pairs = right_masks[left] & right_cell
+            if counters is not None:
+                counters["rule_checks"] += bin(pairs).count("1")
+            for right in _iter_bits(pairs):
+                cell |= parent_masks[left][right]
+    return cell
+
+
+def _close(cell: int, closure: list) -> int:
+    """add every symbol that derives a symbol of the cell through unary rules"""
+    closed = cell
+    for symbol_id in _iter_bits(cell):
+        closed |= closure[symbol_id]
+    return closed
+
+
+class Chart:
+    """
+    the filled CKY chart of one sentence.
+    it is built once and answers recognition, tree extraction, span queries and statistics.
+    """
+    words: tuple
+    grammar: Grammar
+    cells: list  # cells[start][end] is the bitmask of the symbols that can produce words[start:end]
+
+    def __init__(self, words, grammar: Grammar, cells: list = None):
+        self.words = tuple(words)
+        self.grammar = grammar
+        self._forest = None
+        self._stats_record = None  # the sentence's entry in stats.active, if it was on when the chart was filled
+        if cells is not None:
+            self.cells = cells
+        elif stats.active is None:
+            self.cells = fill_chart(self.words, grammar)
+        else:
+            counters = stats.new_counters()
+            start = time.perf_counter()
+            self.cells = fill_chart(self.words, grammar, counters)
+            self._stats_record = stats.active.record_chart(self.words, grammar, self.cells, counters,
+                                                           time.perf_counter() - start)
+
+    def symbols(self, start: int, end: int) -> list:
+        """the nonterminals that can produce words[start:end]"""
+        return [self.grammar.nonterminals[i] for i in _iter_bits(self.cells[start][end])]
+
+    def has_symbol(self, start: int, end: int, symbol: Symbol) -> bool:
+        symbol_id = self.grammar.symbol_ids.get(symbol)
+        return symbol_id is not None and bool(self.cells[start][end] >> symbol_id & 1)
+
+    def is_in_language(self) -> bool:
+        return len(self.words) > 0 and self.has_symbol(0, len(self.words), self.grammar.start_symbol)
+
+    def forest(self) -> ParseForest:
+        if self._forest is None:
+            self._forest = _build_forest(self)
+        return self._forest
+
+    def count_parses(self) -> int:
+        return self.forest().count_parses()
+
+    def parses(self) -> list:
+        return self._counting_nodes(
+            lambda: [ParseTree(self.grammar.start_symbol, [tree]) for tree in self.forest().trees()])
+
+    def _counting_nodes(self, function):
+        """calls function, and adds the ParseNodes it allocates to the sentence's stats if there are any"""
+        if self._stats_record is None or stats.active is None:
+            return function()
+        first_id = parse_module._next_node_id()
+        result = function()
+        stats.active.record_nodes(self._stats_record, parse_module._next_node_id() - first_id - 1)
+        return result
+
+    def partial_parse(self) -> list:
+        """
+        robust mode for input outside the language: covers the words with as few constituents of the chart
+        as possible (a shortest path from 0 to n whose edges are the filled cells), so every constituent is
+        maximal. returns a list of (start, end, ParseNode); words that no symbol produces get a bare word node.
+        """
+        n = len(self.words)
+        uncovered_cost = n + 1  # more than any path of constituents, so words are only left uncovered if they must
+        cost = [0] + [math.inf] * n
+        previous = [0] * (n + 1)
+        for end in range(1, n + 1):
+            for start in range(end):
+                step = 1 if self.cells[start][end] else uncovered_cost if end - start == 1 else math.inf
+                if cost[start] + step < cost[end]:
+                    cost[end], previous[end] = cost[start] + step, start
+        spans = []
+        end = n
+        while end > 0:
+            spans.append((previous[end], end))
+            end = previous[end]
+        return self._counting_nodes(lambda: [(start, end, self._span_tree(start, end)) for start, end in reversed(spans)])
+
+    def _span_tree(self, start: int, end: int) -> ParseNode:
+        """one tree for the span, rooted in the start symbol if it is there and in the topmost symbol otherwise"""
+        cell, grammar = self.cells[start][end], self.grammar
+        if not cell:
+            return ParseNode(Symbol(self.words[start]))
+        start_id = grammar.symbol_ids[grammar.start_symbol]
+        if not cell >> start_id & 1:  # the symbol that the most others of the cell derive through unary rules
+            start_id = max(_iter_bits(cell), key=lambda s: sum(grammar.unary_closure[t] >> s & 1 for t in _iter_bits(cell)))
+        return self._any_tree(start, end, start_id)
+
+    def _any_tree(self, start: int, end: int, symbol_id: int) -> ParseNode:
+        """the first derivation of symbol over words[start:end] found in the chart"""
+        grammar, cells, words = self.grammar, self.cells, self.words
+        base = self._base_split(start, end, symbol_id)
+        if base is None:  # only through a unary chain
+            child = next(child for child in grammar.unary_chains[symbol_id]
+                         if cells[start][end] >> child & 1 and self._base_split(start, end, child) is not None)
+            return unary_chain_node(grammar, symbol_id, child, self._any_tree(start, end, child))
+        if not base:
+            return lexical_node(grammar.nonterminals[symbol_id], words, start, end)
+        mid, left, right = base
+        return ParseNode(grammar.nonterminals[symbol_id],
+                         [self._any_tree(start, mid, left), self._any_tree(mid, end, right)])
+
+    def _base_split(self, start: int, end: int, symbol_id: int):
+        """() for a lexical derivation, (mid, left id, right id) for a binary one, None if there is neither"""
+        grammar, cells, words = self.grammar, self.cells, self.words
+        symbol_bit = 1 << symbol_id
+        if end - start == 1 and grammar.lexical_masks.get(words[start], grammar.unknown_mask) & symbol_bit or \
+                end - start > 1 and grammar.lexical_trie.mask(words, start, end) & symbol_bit:
+            return ()
         for mid in range(start + 1, end):
-            for rule in grammar.rules:
-                if len(rule.rhs) == 2:  # Consider only binary rules
-                    left, right = rule.rhs
-                    if left in chart[start][mid] and right in chart[mid][end]:
-                        left_trees = build_trees(chart, start, mid, left)
-                        right_trees = build_trees(chart, mid, end, right)
-                        # Combine left and right trees with current non-terminal symbol
-                        for lt in left_trees:
-                            for rt in right_trees:
-                                trees.append(ParseNode(symbol, [lt, rt]))
-
-        # Apply unary rules after considering binary rules
-        changed = True
-        while changed:
-            changed = False
-            for rule in grammar.rules:
-                if len(rule.rhs) == 1:  # Consider only unary rules
-                    rhs_symbol = rule.rhs[0]
-                    if rhs_symbol in chart[start][end]:
-                        trees.extend(build_trees(chart, start, end, rule.lhs))
-                        changed = True
-        return trees
-
-    # Initialize chart to store constituents that can generate substrings
+            for left in _iter_bits(cells[start][mid]):
+                for right in _iter_bits(grammar.right_masks[left] & cells[mid][end]):
+                    if grammar.parent_masks[left][right] & symbol_bit:
+                        return mid, left, right
+        return None
+
+    def stats(self) -> dict:
+        n = len(self.words)
+        sizes = [bin(self.cells[start][end]).count("1") for start in range(n) for end in range(start + 1, n + 1)]
+        return {"words": n, "cells": len(sizes), "filled_cells": sum(1 for size in sizes if size),
+                "entries": sum(sizes), "max_cell_size": max(sizes, default=0)}
+
+
+def get_chart(words: list, grammar: Grammar) -> Chart:
+    """
+    returns the chart for words, reusing the chart of an earlier identical query if it is still cached.
+    the cache is the grammar's, so it goes away with the grammar; charts are filled outside of its lock.
+    """
+    key = (grammar.revision, tuple(words))
+    with grammar.chart_cache_lock:
+        chart = grammar.chart_cache.get(key)
+        if chart is not None:
+            grammar.chart_cache.move_to_end(key)
+            return chart
+    chart = Chart(words, grammar)
+    with grammar.chart_cache_lock:
+        chart = grammar.chart_cache.setdefault(key, chart)  # another thread may have filled it meanwhile
+        while len(grammar.chart_cache) > CHART_CACHE_SIZE:
+            grammar.chart_cache.popitem(last=False)
+        _cached_grammars.add(grammar)
+    return chart
+
+
+def _counting_nodes(words: list, grammar: Grammar, function):
+    """
+    calls function, and adds the ParseNodes it allocates to the stats of the sentence if they are on.
+    the sentence's entry is that of its chart, so with stats on, a parser that does not need the chart
+    (like viterbi_parse) fills it too.
+    """
+    if stats.active is None:
+        return function()
+    return get_chart(words, grammar)._counting_nodes(function)
+
+
+def clear_chart_cache(grammar: Grammar = None):
+    """drops the cached charts of grammar, or of all grammars"""
+    for cached in [grammar] if grammar is not None else list(_cached_grammars):
+        cached.clear_chart_cache()
+
+
+def _build_forest(chart: Chart) -> ParseForest:
+    """walks the chart top-down from the root, keeping only items reachable from it"""
+    words, grammar, cells = chart.words, chart.grammar, chart.cells
     n = len(words)
-    chart = [[set() for _ in range(n + 1)] for _ in range(n + 1)]
+    if not chart.is_in_language():
+        return ParseForest(words, grammar, {}, None)
+
+    root = (0, n, grammar.symbol_ids[grammar.start_symbol])
+    items = {}
+    agenda = [root]
+    while agenda:
+        item = agenda.pop()
+        if item in items:
+            continue
+        start, end, symbol_id = item
+        backpointers = items[item] = []
+        symbol_bit = 1 << symbol_id
+        if end - start == 1 and grammar.lexical_masks.get(words[start], grammar.unknown_mask) & symbol_bit or \
+                end - start > 1 and grammar.lexical_trie.mask(words, start, end) & symbol_bit:
+            backpointers.append(())
+        for mid in range(start + 1, end):
+            for left in _iter_bits(cells[start][mid]):
+                for right in _iter_bits(grammar.right_masks[left] & cells[mid][end]):
+                    if grammar.parent_masks[left][right] & symbol_bit:  # there is a rule symbol -> left right
+                        backpointers.append((mid, left, right))
+                        agenda.append((start, mid, left))
+                        agenda.append((mid, end, right))
+        if grammar.has_unary_rules:
+            for child in grammar.unary_rules[symbol_id]:
+                if cells[start][end] >> child & 1:
+                    backpointers.append((child,))
+                    agenda.append((start, end, child))
+    return ParseForest(words, grammar, items, root)
+
+
+ENGINES = ("cky", "earley")  # cky needs a (relaxed) CNF grammar, earley works on any rules
+
+
+# H 3.2
+def is_in_language(words: list, grammar: Grammar, engine: str = "cky") -> bool:
+    assert engine in ENGINES, "unknown parser engine: {}".format(engine)
+    if engine == "earley":
+        return earley.is_in_language(words, grammar)
+    return get_chart(words, grammar).is_in_language()
+
+
+def parse_forest(words: list, grammar: Grammar) -> ParseForest:
+    """
+    parses words and returns the packed forest of all parses.
+    the forest has polynomial size even if the number of parses is exponential.
+    """
+    return get_chart(words, grammar).forest()
+
+
+def count_parses(words: list, grammar: Grammar) -> int:
+    return get_chart(words, grammar).count_parses()
+
+
+# H 4.1.1
+def parse(words: list, grammar: Grammar, engine: str = "cky") -> list:
+    """
+    returns the list of all parse trees.
+    the number of trees can grow exponentially with the sentence length,
+    so for anything but short inputs iterate parse_forest(...).trees() instead.
+    engine="earley" parses with the original rules, so the grammar does not have to be in CNF.
+    """
+    assert engine in ENGINES, "unknown parser engine: {}".format(engine)
+    if engine == "earley":
+        return earley.parse(words, grammar)
+    return get_chart(words, grammar).parses()
+
+
+
+def viterbi_parse(words: list, grammar: Grammar):
+    """
+    returns the best parse tree and its score (the sum of the log weights of its rules),
+    or (None, -inf) if words is not in the language.
+    only the best backpointer per cell and symbol is kept, so the cost does not depend on the ambiguity.
+    """
+    n = len(words)
+    # best[start][end] maps symbol ids to (score, mid, left id, right id);
+    # lexical entries have no mid and no children, unary chains have no mid and only a left (child) id
+    best = [[{} for _ in range(n + 1)] for _ in range(n + 1)]
+    base = {}  # map from (start, end) to the cell before unary chains were added, if there are any
+
+    def add_unary_chains(start, end):
+        cell = best[start][end]
+        base[(start, end)] = dict(cell)
+        for child, (child_score, _, _, _) in base[(start, end)].items():
+            for parent in _iter_bits(grammar.unary_closure[child] & ~(1 << child)):
+                score = child_score + grammar.unary_chain_scores[parent][child]
+                if parent not in cell or score > cell[parent][0]:
+                    cell[parent] = (score, None, child, None)
 
     # Initialize chart with lexical items (words)
     for i in range(1, n + 1):
-        word = words[i - 1]
-        for rule in grammar.rule_map[(Symbol(word),)]:
-            chart[i - 1][i].add(rule.lhs)
+        best[i - 1][i] = {symbol_id: (score, None, None, None)
+                          for symbol_id, score in grammar.lexical_scores.get(words[i - 1], grammar.unknown_scores).items()}
+        if grammar.has_unary_rules:
+            add_unary_chains(i - 1, i)
 
-    # CKY algorithm for parsing
     for length in range(2, n + 1):
         for start in range(n - length + 1):
             end = start + length
+            cell = best[start][end]
+            for symbol_id, score in grammar.lexical_trie.entry_scores(words, start, end).items():
+                cell[symbol_id] = (score, None, None, None)
             for mid in range(start + 1, end):
-                for rule in grammar.rules:
-                    if len(rule.rhs) == 2:  # Consider only binary rules
-                        left, right = rule.rhs
-                        if left in chart[start][mid] and right in chart[mid][end]:
-                            chart[start][end].add(rule.lhs)
+                right_cell = best[mid][end]
+                if not right_cell:
+                    continue
+                for left, (left_score, _, _, _) in best[start][mid].items():
+                    right_map = grammar.binary_scores[left]
+                    for right, (right_score, _, _, _) in right_cell.items():
+                        parents = right_map.get(right)
+                        if not parents:
+                            continue
+                        for parent, rule_score in parents.items():
+                            score = left_score + right_score + rule_score
+                            if parent not in cell or score > cell[parent][0]:
+                                cell[parent] = (score, mid, left, right)
+            if grammar.has_unary_rules and cell:
+                add_unary_chains(start, end)
+
+    def build_tree(start, end, symbol_id, cell=None):
+        _, mid, left, right = (cell or best[start][end])[symbol_id]
+        symbol = grammar.nonterminals[symbol_id]
+        if mid is None and left is None:
+            return lexical_node(symbol, words, start, end)
+        if mid is None:  # a unary chain down to an entry of the base cell
+            return unary_chain_node(grammar, symbol_id, left, build_tree(start, end, left, base[(start, end)]))
+        return ParseNode(symbol, [build_tree(start, mid, left), build_tree(mid, end, right)])
+
+    start_id = grammar.symbol_ids[grammar.start_symbol]
+    if n == 0 or start_id not in best[0][n]:
+        return None, -math.inf
+    tree = _counting_nodes(words, grammar, lambda: ParseTree(grammar.start_symbol, [build_tree(0, n, start_id)]))
+    return tree, best[0][n][start_id][0]
+
+
+def k_best_parses(words: list, grammar: Grammar, k: int) -> list:
+    """
+    returns up to k (score, ParseTree) pairs, best first.
+    uses lazy k-best extraction over the packed forest (Huang & Chiang 2005, algorithm 3):
+    derivations of an item are only enumerated as far as some better derivation above needs them.
+    the vertices are (item, visited) pairs, where visited are the symbols that unary rules
+    must not lead back to (see unary_visited).
+    """
+    chart = get_chart(words, grammar)
+    forest = chart.forest()
+    if not forest:
+        return []
+    derivations = {}  # map from vertices to their best derivations found so far: (score, backpointer, ranks)
+    candidates = {}  # map from vertices to heaps of candidate derivations: (-score, backpointer, ranks)
+    seen = {}  # map from vertices to the (backpointer, ranks) pairs that were ever put into the heap
+
+    def children(vertex, backpointer):
+        (start, end, symbol_id), visited = vertex
+        if len(backpointer) == 3:
+            mid, left, right = backpointer
+            return ((start, mid, left), 0), ((mid, end, right), 0)
+        if len(backpointer) == 1:
+            return ((start, end, backpointer[0]), unary_visited(grammar, visited, symbol_id, backpointer[0])),
+        return ()
+
+    def rule_score(item, backpointer):
+        start, end, symbol_id = item
+        if len(backpointer) == 3:
+            return grammar.binary_scores[backpointer[1]][backpointer[2]][symbol_id]
+        if len(backpointer) == 1:
+            return grammar.unary_rules[symbol_id][backpointer[0]]
+        if end - start > 1:
+            return grammar.lexical_trie.entry_scores(words, start, end)[symbol_id]
+        return grammar.lexical_scores.get(words[start], grammar.unknown_scores)[symbol_id]
+
+    def push_candidate(vertex, backpointer, ranks):
+        if (backpointer, ranks) not in seen[vertex]:
+            seen[vertex].add((backpointer, ranks))
+            score = rule_score(vertex[0], backpointer) + \
+                sum(derivations[child][rank][0] for child, rank in zip(children(vertex, backpointer), ranks))
+            heapq.heappush(candidates[vertex], (-score, backpointer, ranks))
+
+    def push_successors(vertex, backpointer, ranks):
+        for i, child in enumerate(children(vertex, backpointer)):
+            next_ranks = ranks[:i] + (ranks[i] + 1,) + ranks[i + 1:]
+            kth_best(child, next_ranks[i] + 1)
+            if next_ranks[i] < len(derivations[child]):
+                push_candidate(vertex, backpointer, next_ranks)
+
+    def kth_best(vertex, k):
+        """makes sure derivations[vertex] holds its k best derivations (or all of them, if there are fewer)"""
+        item, visited = vertex
+        if vertex not in derivations:
+            derivations[vertex], candidates[vertex], seen[vertex] = [], [], set()
+            for backpointer in forest.items[item]:
+                if len(backpointer) == 1 and visited >> backpointer[0] & 1:
+                    continue
+                edge_children = children(vertex, backpointer)
+                for child in edge_children:
+                    kth_best(child, 1)
+                if all(derivations[child] for child in edge_children):  # a unary cycle can leave none
+                    push_candidate(vertex, backpointer, (0,) * len(edge_children))
+        found = derivations[vertex]
+        while len(found) < k:
+            if found:
+                push_successors(vertex, found[-1][1], found[-1][2])
+            if not candidates[vertex]:
+                break
+            negative_score, backpointer, ranks = heapq.heappop(candidates[vertex])
+            found.append((-negative_score, backpointer, ranks))
+
+    def build_tree(vertex, rank):
+        item = vertex[0]
+        start, end, symbol_id = item
+        _, backpointer, ranks = derivations[vertex][rank]
+        subtrees = [build_tree(child, child_rank) for child, child_rank in zip(children(vertex, backpointer), ranks)]
+        if len(backpointer) == 0:
+            return lexical_node(grammar.nonterminals[symbol_id], words, start, end)
+        return ParseNode(grammar.nonterminals[symbol_id], subtrees)
+
+    root = (forest.root, 0)
+    kth_best(root, k)
+    return chart._counting_nodes(lambda: [
+        (derivations[root][rank][0], ParseTree(grammar.start_symbol, [build_tree(root, rank)]))
+        for rank in range(len(derivations[root]))])
 
-    # Generate parse trees using the built chart
-    trees = build_trees(chart, 0, n, grammar.start_symbol)
-    # Return list of parse trees
-    return [ParseTree(grammar.start_symbol, [tree]) for tree in trees]
 
+def partial_parse(words: list, grammar: Grammar) -> list:
+    """
+    the fewest maximal constituents that cover words, as (start, end, ParseNode) triples,
+    taken from the same chart as parse(); see Chart.partial_parse
+    """
+    return get_chart(words, grammar).partial_parse()
 
 
 def example_telescope_parse():
@@ -0,0 +1,115 @@
+import re
+
+from grammar import *
+
+# the ParseStats that the parser reports to, or None. the parser only looks at it once per sentence;
+# while it is set, the CKY loops count their work into the sentence's counters as they go.
+active = None
+
+
+class ParseStats:
+    """
+    counters of the parser's hot paths, per sentence and summed per grammar:
+      cells           spans of two or more words that CKY filled
+      filled_cells    of those, the ones that got at least one symbol
+      entries         symbols over all cells, including the lexical ones
+      rule_checks     (left, right) child pairs that CKY looked up in the binary rule table
+      unary_symbols   symbols that the unary closure started from
+      unary_added     symbols that only the unary closure put into a cell
+      nodes           ParseNodes allocated while extracting trees
+      seconds         time spent filling the chart
+    """
+    COUNTERS = ("cells", "filled_cells", "entries", "rule_checks", "unary_symbols", "unary_added", "nodes", "seconds")
+
+    sentences: list  # one dict per filled chart: the words, the grammar and the counters
+    grammars: dict  # map from grammars to the sums of their sentences' counters
+
+    def __init__(self):
+        self.sentences = []
+        self.grammars = {}
+
+    def record_chart(self, words, grammar: Grammar, cells: list, counters: dict, seconds: float) -> dict:
+        """adds a sentence with the counters that fill_chart counted into while it filled cells"""
+        counters["seconds"] = seconds
+        record = {"words": tuple(words), "grammar": grammar, "counters": counters, "cells": cells}
+        self.sentences.append(record)
+        self._add(grammar, counters, sentences=1)
+        return record
+
+    def record_nodes(self, record: dict, nodes: int):
+        record["counters"]["nodes"] += nodes
+        self._add(record["grammar"], {"nodes": nodes})
+
+    def _add(self, grammar: Grammar, counters: dict, sentences: int = 0):
+        totals = self.grammars.setdefault(grammar, dict(dict.fromkeys(self.COUNTERS, 0), sentences=0))
+        totals["sentences"] += sentences
+        for name, value in counters.items():
+            totals[name] += value
+
+    def report(self) -> str:
+        lines = ["{:<40} ".format("sentence") + " ".join("{:>13}".format(name) for name in self.COUNTERS)]
+        for record in self.sentences:
+            sentence = " ".join(record["words"])
+            lines.append("{:<40} ".format(sentence if len(sentence) <= 40 else sentence[:37] + "...") +
+                         _format_counters(record["counters"]))
+        for grammar, totals in self.grammars.items():
+            language = re.match(r"language\s+([^;\s]*)", grammar.language).group(1)  # the header line "language en;"
+            lines.append("{:<40} ".format("total: {} ({} rules, {} sentences)".format(
+                language, len(grammar.rules), totals["sentences"])) + _format_counters(totals))
+        return "\n".join(lines)
+
+    def heatmaps(self, top: int = 1) -> str:
+        """the cell size heatmaps of the top sentences with the most rule checks"""
+        records = sorted(self.sentences, key=lambda record: -record["counters"]["rule_checks"])[:top]
+        return "\n\n".join("{}\n{}\nlargest cells (symbols, start, end): {}".format(
+            " ".join(record["words"]), heatmap(record["cells"], record["words"]),
+            hot_spans(record["cells"], record["words"], 5)) for record in records)
+
+
+def _format_counters(counters: dict) -> str:
+    return " ".join("{:>13.6f}".format(counters[name]) if name == "seconds" else "{:>13}".format(counters[name])
+                    for name in ParseStats.COUNTERS)
+
+
+def enable() -> ParseStats:
+    """starts counting into a new ParseStats and returns it"""
+    global active
+    active = ParseStats()
+    return active
+
+
+def disable():
+    global active
+    active = None
+
+
+def new_counters() -> dict:
+    return dict.fromkeys(ParseStats.COUNTERS, 0)
+
+
+def count_cell(counters: dict, grammar: Grammar, base: int, cell: int):
+    """counts a finished cell: base are its symbols before the unary closure, cell those after it"""
+    counters["entries"] += bin(cell).count("1")
+    if grammar.has_unary_rules and base:
+        counters["unary_symbols"] += bin(base).count("1")
+        counters["unary_added"] += bin(cell & ~base).count("1")
+
+
+def heatmap(cells: list, words) -> str:
+    """the number of symbols per span as a triangle: row start, column end (labelled with its last word)"""
+    n = len(words)
+    width = max([len(str(bin(cells[start][end]).count("1"))) for start in range(n) for end in range(start + 1, n + 1)] +
+                [min(len(word), 8) for word in words] + [1])
+    lines = [" " * 4 + " ".join("{:>{}}".format(word[:width], width) for word in words)]
+    for start in range(n):
+        row = ["{:>{}}".format("" if end <= start else bin(cells[start][end]).count("1") or ".", width)
+               for end in range(1, n + 1)]
+        lines.append("{:>3} ".format(start) + " ".join(row))
+    return "\n".join(lines)
+
+
+def hot_spans(cells: list, words, top: int = 10) -> list:
+    """the spans with the most symbols, as (symbol count, start, end)"""
+    n = len(words)
+    spans = [(bin(cells[start][end]).count("1"), start, end) for start in range(n) for end in range(start + 1, n + 1)]
+    return sorted(spans, key=lambda span: (-span[0], span[1], span[2]))[:top]
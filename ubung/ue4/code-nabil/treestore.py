@@ -0,0 +1,212 @@
+import sys
+from array import array
+
+from grammar import Symbol, is_synthetic_symbol
+from parse import *
+
+
+class TreeStore:
+    """
+    compact storage for many parse trees: every node is one entry in a set of parallel arrays,
+    its children are a slice of the children array, and subtrees shared between the trees of a forest
+    are stored once. nodes are read through TreeNode views, which behave like ParseNodes.
+    a store pickles as a handful of flat arrays, so it is cheap to send between processes.
+    """
+    names: list  # symbol names as written in the grammar ("$NP", "duck"); symbols[i] indexes this list
+    symbols: array  # per node: index of its symbol in names
+    first_child: array  # per node: offset of its first child in children
+    arity: array  # per node: number of children, 0 for terminals
+    starts: array  # per node: the first word it covers
+    ends: array  # per node: one past the last word it covers
+    children: array  # node indexes, the children of each node one after another
+    roots: list  # the node indexes of the stored trees, in the order they were added
+
+    def __init__(self):
+        self.names = []
+        self.symbols, self.first_child, self.arity = array("i"), array("i"), array("i")
+        self.starts, self.ends, self.children = array("i"), array("i"), array("i")
+        self.roots = []
+        self._name_ids = {}
+        self._symbol_objects = []
+
+    @classmethod
+    def from_trees(cls, trees):
+        store = cls()
+        store.add_trees(trees)
+        return store
+
+    def add_trees(self, trees) -> list:
+        """adds the trees (ParseNodes); nodes that several of them share are stored once. returns the roots"""
+        trees = list(trees)  # keeps the nodes alive, so that their ids stay unique while they are memoised
+        memo = {}  # map from id(ParseNode) to node index
+        return [self.add_tree(tree, memo) for tree in trees]
+
+    def add_tree(self, tree: ParseNode, memo: dict = None) -> int:
+        """stores the tree, iteratively and bottom-up, and returns the index of its root"""
+        memo = {} if memo is None else memo
+        position = 0  # the next word of the sentence
+        built = []  # indexes of finished nodes, in the order their parents expect them
+        stack = [(tree, None)]  # (node, None) before its children are done, (node, first word) after
+        while stack:
+            node, start = stack.pop()
+            if start is None:
+                index = memo.get(id(node))
+                if index is not None:
+                    built.append(index)
+                    position += self.ends[index] - self.starts[index]
+                elif node.productions:
+                    stack.append((node, position))
+                    stack.extend((p, None) for p in reversed(node.productions))
+                else:
+                    built.append(self._add_node(node, (), position, position + 1, memo))
+                    position += 1
+            else:
+                children = built[len(built) - len(node.productions):]
+                del built[len(built) - len(node.productions):]
+                built.append(self._add_node(node, children, start, position, memo))
+        self.roots.append(built[0])
+        return built[0]
+
+    def _add_node(self, node, children, start: int, end: int, memo: dict) -> int:
+        index = self.add_node(repr(node.symbol), children, start, end)
+        memo[id(node)] = index
+        return index
+
+    def add_node(self, name: str, children, start: int, end: int) -> int:
+        """appends a node with the symbol name and the given child indexes and returns its index"""
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        self.symbols.append(name_id)
+        self.first_child.append(len(self.children))
+        self.arity.append(len(children))
+        self.starts.append(start)
+        self.ends.append(end)
+        self.children.extend(children)
+        return len(self.symbols) - 1
+
+    def node(self, index: int) -> "TreeNode":
+        return TreeNode(self, index)
+
+    def symbol(self, index: int) -> Symbol:
+        name_id = self.symbols[index]
+        while len(self._symbol_objects) <= name_id:  # one Symbol per name, made when first asked for
+            self._symbol_objects.append(Symbol(self.names[len(self._symbol_objects)]))
+        return self._symbol_objects[name_id]
+
+    def child_indexes(self, index: int):
+        first = self.first_child[index]
+        return self.children[first:first + self.arity[index]]
+
+    def __len__(self):
+        return len(self.roots)
+
+    def __getitem__(self, i: int) -> "TreeNode":
+        return TreeNode(self, self.roots[i])
+
+    def __iter__(self):
+        return (TreeNode(self, root) for root in self.roots)
+
+    def __repr__(self):
+        # the same as the repr of the list of trees the store was made from
+        return "[" + ", ".join(repr(tree) for tree in self) + "]"
+
+    def __getstate__(self):
+        return {"names": self.names, "symbols": self.symbols, "first_child": self.first_child, "arity": self.arity,
+                "starts": self.starts, "ends": self.ends, "children": self.children, "roots": self.roots}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._name_ids = {name: i for i, name in enumerate(self.names)}
+        self._symbol_objects = []
+
+    def memory_usage(self) -> int:
+        """bytes held by the arrays and the symbol names"""
+        return sum(sys.getsizeof(a) for a in (self.symbols, self.first_child, self.arity, self.starts, self.ends,
+                                              self.children, self.names, self.roots)) + \
+            sum(sys.getsizeof(name) for name in self.names)
+
+
+class TreeNode:
+    """
+    a view of one node of a TreeStore with the API of ParseNode (and ParseTree's DOT export).
+    views are made on the fly and hold nothing but the store and the node index.
+    """
+    __slots__ = ("store", "index")
+
+    def __init__(self, store: TreeStore, index: int):
+        self.store, self.index = store, index
+
+    @property
+    def id(self) -> int:
+        return self.index
+
+    @property
+    def symbol(self) -> Symbol:
+        return self.store.symbol(self.index)
+
+    @property
+    def productions(self) -> list:
+        return [TreeNode(self.store, child) for child in self.store.child_indexes(self.index)]
+
+    @property
+    def start(self) -> int:
+        return self.store.starts[self.index]
+
+    @property
+    def end(self) -> int:
+        return self.store.ends[self.index]
+
+    def __eq__(self, other):
+        return isinstance(other, TreeNode) and self.store is other.store and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+    # the traversals of ParseNode only use id, symbol and productions, so they work on views as they are
+    iter_nodes = ParseNode.iter_nodes
+    collect_terminals = ParseNode.collect_terminals
+    write_bracketed = ParseNode.write_bracketed
+    write_json = ParseNode.write_json
+    to_json = ParseNode.to_json
+    __repr__ = ParseNode.__repr__
+    _write_dot_productions = ParseNode._write_dot_productions
+    _to_dot_productions = ParseNode._to_dot_productions
+    write_dot = ParseTree.write_dot
+    to_dot = ParseTree.to_dot
+    _write_dot_terminals_subgraph = ParseTree._write_dot_terminals_subgraph
+    _to_dot_terminals_subgraph = ParseTree._to_dot_terminals_subgraph
+
+    def remove_normalized_nodes(self, synthetic=None) -> "TreeNode":
+        """
+        like ParseNode.remove_normalized_nodes: the children of nodes with synthetic symbols move up into
+        their parents. the result is built into a new TreeStore, bottom-up; this store is not changed.
+        """
+        store, copy = self.store, TreeStore()
+        is_synthetic = synthetic.__contains__ if synthetic is not None else is_synthetic_symbol
+        result = {}  # map from node index to the index of its copy
+        stack = [(self.index, None)]  # (index, None) before its children are done, (index, its real children) after
+        while stack:
+            index, children = stack.pop()
+            if index in result:
+                continue
+            if children is None:
+                children, pending = [], list(reversed(store.child_indexes(index)))
+                while pending:  # synthetic children are replaced by their own real children
+                    child = pending.pop()
+                    if is_synthetic(store.symbol(child)):
+                        pending.extend(reversed(store.child_indexes(child)))
+                    else:
+                        children.append(child)
+                stack.append((index, children))
+                stack.extend((child, None) for child in children if child not in result)
+                continue
+            result[index] = copy.add_node(store.names[store.symbols[index]], [result[child] for child in children],
+                                          store.starts[index], store.ends[index])
+        copy.roots.append(result[self.index])
+        return TreeNode(copy, result[self.index])
+
+    def to_parse_node(self, cls=ParseNode) -> ParseNode:
+        """copies the tree into ParseNodes; the root is an instance of cls"""
+        return cls.from_json(self.to_json())
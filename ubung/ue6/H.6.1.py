@@ -1,5 +1,11 @@
 import argparse
+import heapq
 import random
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import repeat
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('--random-seed', type=int, default=1,
@@ -8,6 +14,10 @@ parser.add_argument('--source', type=str, required=True)
 parser.add_argument('-N', type=int, default=3)
 parser.add_argument('--start', type=str, required=True)
 parser.add_argument('--length', type=int, default=5000)
+parser.add_argument('--store', choices=['dict', 'packed'], default='dict',
+                    help='the tree of dicts below, or the flat PackedNGramCounts, which needs much less memory')
+parser.add_argument('--sampling', choices=['alias', 'choices'], default='alias',
+                    help='draw with alias tables built once per prefix, or with random.choices over the counts')
 
 # let's represent n-grams in the following way
 # for each n-gram prefix we keep a hash which includes the count at key, say, 0,
@@ -23,6 +33,127 @@ def ngrams_from_text(f, N):
         last = f.read(1)
 
 
+CHUNK_SIZE = 1 << 20  # characters per read
+
+
+def ngrams_from_text_chunked(f, N, chunk_size=CHUNK_SIZE):
+    """
+    the same n-grams as ngrams_from_text (with the prefix as a string), but read chunk_size characters at a time.
+    the last N-1 characters of a chunk are carried over to the next one, so no n-gram across a chunk boundary is lost
+    """
+    carry = ''
+    for chunk in iter(lambda: f.read(chunk_size), ''):
+        text = carry + chunk
+        for i in range(len(text) - N + 1):
+            yield text[i:i + N - 1], text[i + N - 1]
+        carry = text[max(len(text) - N + 1, 0):] if N > 1 else ''
+
+
+def count_ngrams(f, N, chunk_size=CHUNK_SIZE):
+    """
+    counts the n-grams (as tuples of N characters) of the text, chunk by chunk like ngrams_from_text_chunked,
+    with the n-grams zipped together and counted in C. the counter lists them in the order they first occur
+    """
+    counts = Counter()
+    carry = ''
+    for chunk in iter(lambda: f.read(chunk_size), ''):
+        text = carry + chunk
+        counts.update(zip(*(text[k:] for k in range(N))))
+        carry = text[max(len(text) - N + 1, 0):] if N > 1 else ''
+    return counts
+
+
+def _pack(codes) -> int:
+    return int.from_bytes(bytes(codes), 'big')
+
+
+class PackedNGramCounts:
+    """
+    the n-gram counts as two parallel arrays sorted by n-gram instead of a tree of dicts.
+    every character gets a one-byte code and an n-gram is the big-endian integer of its codes,
+    so all n-grams with the same prefix are next to each other and one bisect finds them.
+    16 bytes per distinct n-gram, for N <= 8 and texts of at most 256 different characters.
+    """
+    N: int
+    chars: list  # the character of each code
+    codes: dict  # map from ord(character) to chr(code), a table for str.translate
+    keys: array  # the packed n-grams, sorted
+    counts: array  # the count of each key
+
+    def __init__(self, N):
+        assert 1 <= N <= 8, "n-grams of more than 8 characters do not fit into 64 bits"
+        self.N = N
+        self.chars = []
+        self.codes = {}
+        self.keys, self.counts = array('Q'), array('q')
+        self._runs = []  # sorted (keys, counts) of the texts added since the last merge
+
+    @classmethod
+    def from_file(cls, f, N, chunk_size=CHUNK_SIZE):
+        """counts the n-grams of the file chunk by chunk, with the overlap of ngrams_from_text_chunked"""
+        store = cls(N)
+        carry = ''
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            text = carry + chunk
+            store.add_text(text)
+            carry = text[max(len(text) - N + 1, 0):] if N > 1 else ''
+        return store
+
+    def encode(self, text) -> bytes:
+        """the codes of the characters of text, adding codes for new characters"""
+        for c in set(text) - set(self.chars):
+            assert len(self.chars) < 256, "more than 256 different characters"
+            self.codes[ord(c)] = chr(len(self.chars))
+            self.chars.append(c)
+        return text.translate(self.codes).encode('latin-1')
+
+    def add_text(self, text):
+        """
+        counts the n-grams of text: counted and sorted per text, then merged into the arrays.
+        runs are merged once they hold more than the arrays, so every n-gram is merged only a few times
+        """
+        codes = self.encode(text)
+        counted = Counter(zip(*(codes[k:] for k in range(self.N))))
+        ngrams = sorted(counted)  # tuples of codes sort like their packed keys
+        keys = map(int.from_bytes, map(bytes, ngrams), repeat('big'))  # _pack, without a Python call per n-gram
+        self._runs.append((array('Q', keys), array('q', map(counted.__getitem__, ngrams))))
+        if sum(len(keys) for keys, _ in self._runs) > 4 * len(self.keys):
+            self._merge_runs()
+
+    def _merge_runs(self):
+        if not self._runs:
+            return
+        keys, counts = array('Q'), array('q')
+        for key, count in heapq.merge(zip(self.keys, self.counts), *(zip(*run) for run in self._runs)):
+            if keys and keys[-1] == key:
+                counts[-1] += count
+            else:
+                keys.append(key)
+                counts.append(count)
+        self.keys, self.counts = keys, counts
+        self._runs = []
+
+    def next_chars(self, prefix):
+        """the characters that follow prefix (N-1 characters) and their counts, in the order of their codes"""
+        self._merge_runs()
+        if any(ord(c) not in self.codes for c in prefix):
+            return [], []
+        low = _pack(ord(self.codes[ord(c)]) for c in prefix) << 8
+        start = bisect_left(self.keys, low)
+        end = bisect_left(self.keys, low + 256, start)
+        return [self.chars[key & 255] for key in self.keys[start:end]], self.counts[start:end]
+
+    def __len__(self):
+        self._merge_runs()
+        return len(self.keys)
+
+    def memory_usage(self) -> int:
+        """bytes held by the arrays and the character tables"""
+        self._merge_runs()
+        return sum(sys.getsizeof(x) for x in (self.keys, self.counts, self.chars, self.codes)) + \
+            sum(sys.getsizeof(c) for c in self.chars)
+
+
 def get_base_node(model, prefix):
     """from our model tree, get the node that represents the prefix"""
     node = model
@@ -33,29 +164,71 @@ def get_base_node(model, prefix):
     return node
 
 
-def add_ngram_to_model(model, prefix, last):
+def add_ngram_to_model(model, prefix, last, count=1):
     base = get_base_node(model, prefix)
     if last not in base:
         base[last] = 0
-    base[last] += 1
+    base[last] += count
+
+
+def alias_table(counts):
+    """
+    Vose's alias table for drawing index i with probability counts[i] / sum(counts) in O(1):
+    column i keeps i with probability keep[i] and gives alias[i] otherwise
+    """
+    n = len(counts)
+    total = sum(counts)
+    scaled = [count * n / total for count in counts]
+    keep, alias = [1.0] * n, list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1]
+    large = [i for i, p in enumerate(scaled) if p >= 1]
+    while small and large:
+        i, j = small.pop(), large.pop()
+        keep[i], alias[i] = scaled[i], j
+        scaled[j] -= 1 - scaled[i]
+        (small if scaled[j] < 1 else large).append(j)
+    return keep, alias
+
+
+def draw(items, keep, alias):
+    """one draw from an alias table, with a single random number for both the column and the coin"""
+    u = random.random() * len(items)
+    i = int(u)
+    return items[i] if u - i < keep[i] else items[alias[i]]
+
+
+def next_char_counts(model, prefix):
+    if isinstance(model, PackedNGramCounts):
+        return model.next_chars(prefix)
+    return zip(*get_base_node(model, prefix).items())
 
 
-def generate(model, start):
-    start = list(start)
+def generate(model, start, sampling='alias'):
+    start = ''.join(start)
+    tables = {}  # map from prefixes to (chars, keep, alias), built the first time the prefix comes up
     while True:
-        base = get_base_node(model, start)
-        chars, counts = zip(*base.items())
-        char_list = random.choices(population=chars, weights=counts, k=1)
-        start = start[1:] + char_list
-        yield char_list[0]
+        if sampling == 'alias':
+            table = tables.get(start)
+            if table is None:
+                chars, counts = next_char_counts(model, start)
+                table = tables[start] = (chars, *alias_table(counts))
+            char = draw(*table)
+        else:
+            chars, counts = next_char_counts(model, start)
+            char = random.choices(population=chars, weights=counts, k=1)[0]
+        start = (start + char)[1:]
+        yield char
 
 
 def estimate_model(args):
+    if args.store == 'packed':
+        with open(args.source, 'r', encoding='utf-8') as f:
+            return PackedNGramCounts.from_file(f, args.N)
     model = {}
     with open(args.source, 'r', encoding='utf-8') as f:
-        ngram_source = ngrams_from_text(f, args.N)
-        for ngram in ngram_source:
-            add_ngram_to_model(model, ngram[0], ngram[1])
+        # the same model as adding every n-gram of ngrams_from_text on its own, in the same order
+        for ngram, count in count_ngrams(f, args.N).items():
+            add_ngram_to_model(model, ngram[:-1], ngram[-1], count)
     return model
 
 
@@ -65,7 +238,7 @@ if __name__ == '__main__':
     assert len(args.start) == args.N - 1
     print(args.start, end='')
     i = 0
-    for c in generate(model, args.start):
+    for c in generate(model, args.start, args.sampling):
         print(c, end='')
         i += 1
         if i > args.length:
@@ -0,0 +1,160 @@
+import argparse
+import importlib.util
+import io
+import itertools
+import os
+import random
+import time
+import tracemalloc
+
+# H.6.1.py is not a valid module name, so load it from its path
+_spec = importlib.util.spec_from_file_location("ngram_model", os.path.join(os.path.dirname(__file__), "H.6.1.py"))
+ngram_model = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(ngram_model)
+
+arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="timings of the character n-gram model")
+arg_parser.add_argument('--source', type=str, default=os.path.join(os.path.dirname(__file__), "data", "merkel-de.txt"))
+arg_parser.add_argument('-N', type=int, nargs='+', default=[3, 5])
+arg_parser.add_argument('--repeat', type=int, default=1)
+arg_parser.add_argument('--stores-N', type=int, nargs='+', default=[5, 6, 7],
+                        help="n-gram sizes for the comparison of the dict tree with PackedNGramCounts")
+arg_parser.add_argument('--tokens', type=int, default=200000, help="characters to generate per sampling mode")
+
+
+def model_from_ngrams(ngrams):
+    model = {}
+    for prefix, last in ngrams:
+        ngram_model.add_ngram_to_model(model, prefix, last)
+    return model
+
+
+def model_from_counts(counts):
+    model = {}
+    for ngram, count in counts.items():
+        ngram_model.add_ngram_to_model(model, ngram[:-1], ngram[-1], count)
+    return model
+
+
+def same_model(a, b) -> bool:
+    """equal counts and the same order of the next characters everywhere (which random.choices depends on)"""
+    if isinstance(a, int) or isinstance(b, int):
+        return a == b
+    return list(a) == list(b) and all(same_model(a[c], b[c]) for c in a)
+
+
+def timed(function, path, repeat):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        with open(path, 'r', encoding='utf-8') as f:
+            start = time.perf_counter()
+            result = function(f)
+            best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def check_chunk_boundaries(text, N):
+    """
+    the chunked readers agree with the character-wise one for chunk sizes around N, where boundaries are dense
+    (N >= 2: ngrams_from_text does not support N = 1)
+    """
+    reference = model_from_ngrams(ngram_model.ngrams_from_text(io.StringIO(text), N))
+    for chunk_size in (1, 2, N - 1, N, N + 1, 1000):
+        assert same_model(reference, model_from_ngrams(
+            ngram_model.ngrams_from_text_chunked(io.StringIO(text), N, chunk_size))), chunk_size
+        assert same_model(reference, model_from_counts(
+            ngram_model.count_ngrams(io.StringIO(text), N, chunk_size))), chunk_size
+
+
+def report_readers(path, N, repeat):
+    """model estimation with the character-wise reader against the chunked ones, in MB/s of the source file"""
+    megabytes = os.path.getsize(path) / 1e6
+    results = {}
+    for name, function in (("read(1)", lambda f: model_from_ngrams(ngram_model.ngrams_from_text(f, N))),
+                           ("chunked", lambda f: model_from_ngrams(ngram_model.ngrams_from_text_chunked(f, N))),
+                           ("chunked count", lambda f: model_from_counts(ngram_model.count_ngrams(f, N)))):
+        results[name] = timed(function, path, repeat)
+    reference = results["read(1)"][1]
+    assert all(same_model(reference, model) for _, model in results.values()), "the readers disagree"
+    print("{:<20} N={} {:.1f} MB: ".format(os.path.basename(path), N, megabytes) +
+          "; ".join("{} {:.2f}s {:.2f} MB/s".format(name, elapsed, megabytes / elapsed)
+                    for name, (elapsed, _) in results.items()))
+
+
+def dict_model_items(model, prefix=''):
+    """(n-gram, count) of a tree of dicts"""
+    for c, node in model.items():
+        if isinstance(node, int):
+            yield prefix + c, node
+        else:
+            yield from dict_model_items(node, prefix + c)
+
+
+def measured(function):
+    """the result of function, the seconds it took and the bytes it left allocated (measured in a second run)"""
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = function()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, elapsed, size
+
+
+def report_stores(path, N):
+    """memory and build time of the tree of dicts against the packed arrays, for the same counts"""
+    def build(store):
+        return lambda: ngram_model.estimate_model(argparse.Namespace(source=path, N=N, store=store))
+
+    tree, tree_time, tree_size = measured(build('dict'))
+    packed, packed_time, packed_size = measured(build('packed'))
+    ngrams = dict(dict_model_items(tree))
+    assert len(ngrams) == len(packed)
+    for prefix in {ngram[:-1] for ngram in ngrams}:
+        chars, counts = packed.next_chars(prefix)
+        assert {c: count for c, count in zip(chars, counts)} == ngram_model.get_base_node(tree, prefix)
+    print("{:<20} N={} {} n-grams: dict tree {:.1f} MB ({:.0f} B/n-gram) {:.2f}s; "
+          "packed {:.1f} MB ({:.0f} B/n-gram) {:.2f}s".format(
+              os.path.basename(path), N, len(packed), tree_size / 1e6, tree_size / len(packed), tree_time,
+              packed_size / 1e6, packed_size / len(packed), packed_time))
+
+
+def check_alias_table(counts):
+    """the alias table gives each index its relative count"""
+    keep, alias = ngram_model.alias_table(counts)
+    n = len(counts)
+    probabilities = [p / n for p in keep]
+    for i, j in enumerate(alias):
+        probabilities[j] += (1 - keep[i]) / n
+    for p, count in zip(probabilities, counts):
+        assert abs(p - count / sum(counts)) < 1e-9, (counts, probabilities)
+
+
+def report_sampling(path, N, tokens):
+    """characters per second that generate produces with random.choices and with alias tables"""
+    model = ngram_model.estimate_model(argparse.Namespace(source=path, N=N, store='dict'))
+    start = next(iter(dict_model_items(model)))[0][:N - 1]
+    results = []
+    for sampling in ('choices', 'alias'):
+        random.seed(1)
+        begin = time.perf_counter()
+        for _ in itertools.islice(ngram_model.generate(model, start, sampling), tokens):
+            pass
+        results.append("{} {:.2f}M chars/s".format(sampling, tokens / (time.perf_counter() - begin) / 1e6))
+    print("{:<20} N={} generate: {}".format(os.path.basename(path), N, "; ".join(results)))
+
+
+if __name__ == '__main__':
+    args = arg_parser.parse_args()
+    with open(args.source, 'r', encoding='utf-8') as f:
+        sample = f.read(20000)
+    for N in args.N:
+        check_chunk_boundaries(sample, N)
+        report_readers(args.source, N, args.repeat)
+    for N in args.stores_N:
+        report_stores(args.source, N)
+    for counts in ([1], [1, 2, 3, 1000, 5, 0, 7], [random.randrange(1, 100) for _ in range(5000)]):
+        check_alias_table(counts)
+    for N in args.N:
+        report_sampling(args.source, N, args.tokens)
@@ -1,25 +1,85 @@
 import sys
-from collections import defaultdict, Counter
+from collections import Counter
 import random
 
+ID_BITS = 32  # Bits per token id in packed contexts and n-grams, enough for 4 billion different tokens
+
+
+class Vocabulary:
+    # Maps tokens to dense ints, in the order they are first seen, and back
+    def __init__(self):
+        self.ids = {}
+        self.tokens = []
+
+    def add(self, token):
+        # The id of the token, which is added if it is new
+        id = self.ids.get(token)
+        if id is None:
+            id = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return id
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __contains__(self, token):
+        return token in self.ids
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+
 class NGramModel:
     def __init__(self, n):
         self.n = n
-        self.ngrams = defaultdict(Counter)
+        self.vocabulary = Vocabulary()
+        # Counts per n-gram: the ids of its n tokens packed into one int (ID_BITS bits each), so no tuple,
+        # string or Counter is stored per n-gram or context. The context of an n-gram is ngram >> ID_BITS
+        self.ngrams = Counter()
         self.start_symbol = "<s>"
         self.end_symbol = "</s>"
+        self.samplers = {}  # Alias tables per context, built when the context is first sampled from
+        self.followers = None  # Map from contexts to the ids of the words seen after them, built for sampling
 
     def update(self, text):
+        # New counts make the alias tables outdated
+        self.samplers = {}
+        self.followers = None
         # Split the text into lines
         lines = text.strip().split('\n')
+        add = self.vocabulary.add
         for line in lines:
             # Prepend <s> symbols and append </s>
             tokens = [self.start_symbol] * (self.n - 1) + line.split() + [self.end_symbol]
-            # Generate n-grams for the current line
-            for i in range(len(tokens) - self.n + 1):
-                context = tuple(tokens[i:i + self.n - 1])
-                next_word = tokens[i + self.n - 1]
-                self.ngrams[context][next_word] += 1
+            # Count the n-grams of the current line
+            for context, next_word in self.ngram_keys([add(token) for token in tokens]):
+                self.ngrams[context << ID_BITS | next_word] += 1
+
+    def ngram_keys(self, ids):
+        # (packed context, id of the next word) for every n-gram of the token ids
+        mask = (1 << ID_BITS * (self.n - 1)) - 1
+        context = 0
+        for i, word in enumerate(ids):
+            if i >= self.n - 1:
+                yield context, word
+            context = (context << ID_BITS | word) & mask
+
+    def encode(self, tokens):
+        # The ids of the tokens without adding new ones: unknown tokens get an id that no n-gram of the model has
+        unknown = len(self.vocabulary)
+        return [self.vocabulary.ids.get(token, unknown) for token in tokens]
+
+    def context_key(self, context):
+        # The packed form of a context given as a tuple of tokens
+        key = 0
+        for word in self.encode(context):
+            key = key << ID_BITS | word
+        return key
+
+    def decode_context(self, key):
+        # The tuple of tokens of a packed context
+        mask = (1 << ID_BITS) - 1
+        return tuple(self.vocabulary.tokens[key >> ID_BITS * k & mask] for k in range(self.n - 2, -1, -1))
 
     def generate(self, length):
         # Start with the initial context of <s> symbols
@@ -34,15 +94,49 @@ class NGramModel:
         return ' '.join(result[self.n - 1:])
 
     def choose_word(self, context):
-        possible_words = list(self.ngrams[context].keys())
-        probabilities = list(self.ngrams[context].values())
-        total = sum(probabilities)
-        probabilities = [p / total for p in probabilities]
-        return random.choices(possible_words, probabilities)[0]
+        # Choose the next word based on the context using the probability distribution,
+        # in O(1) with the context's alias table
+        key = self.context_key(context)
+        sampler = self.samplers.get(key)
+        if sampler is None:
+            sampler = self.samplers[key] = self.build_sampler(key)
+        words, keep, alias = sampler
+        u = random.random() * len(words)  # One random number picks the column and decides between its two words
+        i = int(u)
+        return words[i] if u - i < keep[i] else words[alias[i]]
+
+    def build_sampler(self, key):
+        # Vose's alias table for a packed context:
+        # column i keeps words[i] with probability keep[i] and gives words[alias[i]] otherwise
+        followers = self.context_followers().get(key, [])
+        counts = [self.ngrams[key << ID_BITS | word] for word in followers]
+        words = [self.vocabulary.tokens[word] for word in followers]
+        total = sum(counts)
+        scaled = [count * len(words) / total for count in counts] if total else []
+        keep, alias = [1.0] * len(words), list(range(len(words)))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            i, j = small.pop(), large.pop()
+            keep[i], alias[i] = scaled[i], j
+            scaled[j] -= 1 - scaled[i]
+            (small if scaled[j] < 1 else large).append(j)
+        return words, keep, alias
+
+    def context_followers(self):
+        # The words seen after each context, in the order they were first seen, grouped in one pass over the counts
+        if self.followers is None:
+            self.followers = {}
+            mask = (1 << ID_BITS) - 1
+            for ngram in self.ngrams:
+                self.followers.setdefault(ngram >> ID_BITS, []).append(ngram & mask)
+        return self.followers
 
     def print_model(self):
-        for context, counter in self.ngrams.items():
-            print(f"{context}: {dict(counter)}")
+        # Print the n-grams and their counts
+        for context, followers in self.context_followers().items():
+            words = {self.vocabulary.tokens[word]: self.ngrams[context << ID_BITS | word] for word in followers}
+            print(f"{self.decode_context(context)}: {words}")
 
 if __name__ == "__main__":
     n = int(sys.argv[1])
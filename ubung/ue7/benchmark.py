@@ -0,0 +1,198 @@
+import argparse
+import importlib.util
+import math
+import os
+import random
+import time
+import tracemalloc
+from collections import defaultdict, Counter
+from types import SimpleNamespace
+
+arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="timings of the word n-gram models")
+arg_parser.add_argument('--model', choices=["H.7.1", "H.7.2", "H.7.3"], default="H.7.3",
+                        help="the exercise whose NGramModel to measure")
+arg_parser.add_argument('--train', type=str, default=os.path.join(os.path.dirname(__file__), "data", "merkel-de.txt"))
+arg_parser.add_argument('--test', type=str, default=os.path.join(os.path.dirname(__file__), "data", "dialoge-de.txt"))
+arg_parser.add_argument('-n', type=int, nargs='+', default=[2, 3])
+arg_parser.add_argument('--tokens', type=int, default=1000000, help="words to sample with the alias tables")
+arg_parser.add_argument('--reference-tokens', type=int, default=20000,
+                        help="words to sample with random.choices, which is slow for contexts with many words")
+
+
+def load_model_module(name):
+    """the exercise files are not valid module names, so load them from their paths"""
+    spec = importlib.util.spec_from_file_location(name.replace(".", "_"),
+                                                  os.path.join(os.path.dirname(__file__), name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def string_ngrams(text, n):
+    """the counts as NGramModel kept them before the vocabulary: Counters of words per tuple of context words"""
+    ngrams = defaultdict(Counter)
+    for line in text.strip().split('\n'):
+        tokens = ["<s>"] * (n - 1) + line.split() + ["</s>"]
+        for i in range(len(tokens) - n + 1):
+            ngrams[tuple(tokens[i:i + n - 1])][tokens[i + n - 1]] += 1
+    return ngrams
+
+
+def reference_model(model, text):
+    """the model's counts keyed by strings, with the attributes that the reference functions below read"""
+    reference = SimpleNamespace(n=model.n, start_symbol=model.start_symbol, end_symbol=model.end_symbol,
+                                ngrams=string_ngrams(text, model.n))
+    if hasattr(model, "alphabet"):
+        reference.alphabet = model.alphabet
+    return reference
+
+
+def choose_word_with_choices(model, context):
+    """choose_word before the alias tables: normalises the counts of the context on every call"""
+    possible_words = list(model.ngrams[context].keys())
+    probabilities = list(model.ngrams[context].values())
+    total = sum(probabilities)
+    probabilities = [p / total for p in probabilities]
+    return random.choices(possible_words, probabilities)[0]
+
+
+def sample_words(model, count, choose_word):
+    """count words from the model, starting a new sentence after every end symbol"""
+    start = (model.start_symbol,) * (model.n - 1)
+    context = start
+    for _ in range(count):
+        word = choose_word(model, context)
+        context = start if word == model.end_symbol else (context + (word,))[1:]
+
+
+def alias_probabilities(keep, alias):
+    """the probability of each column's word that an alias table gives"""
+    n = len(keep)
+    probabilities = [p / n for p in keep]
+    for i, j in enumerate(alias):
+        probabilities[j] += (1 - keep[i]) / n
+    return probabilities
+
+
+def check_samplers(module, model):
+    """the alias table of every context gives each word its relative count"""
+    for key, followers in model.context_followers().items():
+        words, keep, alias = model.build_sampler(key)
+        total = sum(model.ngrams[key << module.ID_BITS | word] for word in followers)
+        for word, p in zip(words, alias_probabilities(keep, alias)):
+            count = model.ngrams[key << module.ID_BITS | model.vocabulary.ids[word]]
+            assert abs(p - count / total) < 1e-9, (model.decode_context(key), word)
+
+
+def report_sampling(module, path, n, tokens, reference_tokens):
+    """words per second that choose_word samples with random.choices and with alias tables"""
+    model, text = trained_model(module, path, n)
+    check_samplers(module, model)
+    reference = reference_model(model, text)
+    results = []
+    for name, sampled_model, choose_word, count in (
+            ("choices", reference, choose_word_with_choices, reference_tokens),
+            ("alias", model, module.NGramModel.choose_word, tokens)):
+        random.seed(1)
+        start = time.perf_counter()
+        sample_words(sampled_model, count, choose_word)
+        results.append("{} {:.3f}M words/s".format(name, count / (time.perf_counter() - start) / 1e6))
+    print("{:<20} n={} {} contexts: {}".format(os.path.basename(path), n, len(model.context_followers()),
+                                                 "; ".join(results)))
+
+
+def trained_model(module, path, n):
+    """the model trained on the file, and the text of the file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    return trained_model_from_text(module, text, n), text
+
+
+def perplexity_with_sums(model, text):
+    """calculate_perplexity before the cached totals: sums the counts of the context for every token"""
+    tokens = [model.start_symbol] * (model.n - 1) + text.split() + [model.end_symbol]
+    log_prob_sum = 0
+    for i in range(len(tokens) - model.n + 1):
+        context, word = tuple(tokens[i:i + model.n - 1]), tokens[i + model.n - 1]
+        counter = model.ngrams.get(context, {})
+        if hasattr(model, "alphabet"):  # H.7.3: Laplace smoothing
+            prob = (counter.get(word, 0) + 1) / (sum(counter.values()) + len(model.alphabet))
+        else:
+            prob = counter[word] / sum(counter.values()) if word in counter else 1e-6
+        log_prob_sum += math.log(prob)
+    return math.exp(-log_prob_sum / len(tokens))
+
+
+def report_scoring(module, train_path, test_path, n):
+    """perplexity of the test file with per-token sums, with the cached totals, and batched with score_corpus"""
+    model, train_text = trained_model(module, train_path, n)
+    reference = reference_model(model, train_text)
+    with open(test_path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    sizes = len(model.ngrams), len(getattr(model, "totals", ()))  # the n-grams and the contexts with cached totals
+    results = {}
+    for name, function in (("sums", lambda: perplexity_with_sums(reference, text)),
+                           ("totals", lambda: model.calculate_perplexity(text)),
+                           ("score_corpus", lambda: model.score_corpus(text)[1])):
+        start = time.perf_counter()
+        results[name] = (function(), time.perf_counter() - start)
+    assert (len(model.ngrams), len(getattr(model, "totals", ()))) == sizes, \
+        "scoring added n-grams or contexts to the model"
+    reference = results["sums"][0]
+    assert all(abs(p - reference) <= 1e-9 * reference for p, _ in results.values()), results
+    print("{:<20} n={} perplexity on {} {:.1f}: ".format(os.path.basename(train_path), n, os.path.basename(test_path),
+                                                          reference) +
+          "; ".join("{} {:.3f}s".format(name, elapsed) for name, (_, elapsed) in results.items()))
+
+
+def retained_bytes(function):
+    """the result of function and the bytes it left allocated"""
+    tracemalloc.start()
+    result = function()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def report_memory(module, path, n):
+    """
+    bytes per distinct n-gram of the counts keyed by string tuples (and their totals, where the model keeps them)
+    and of the model with the vocabulary
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    with_totals = hasattr(module.NGramModel(n), "totals")  # the models that cache them keep one entry per context
+
+    def string_model():
+        ngrams = string_ngrams(text, n)
+        totals = Counter({context: sum(counter.values()) for context, counter in ngrams.items()}) if with_totals else None
+        return ngrams, totals
+
+    (ngrams, _), strings_size = retained_bytes(string_model)
+    model, model_size = retained_bytes(lambda: trained_model_from_text(module, text, n))
+    id_bits = module.ID_BITS
+    assert {model.decode_context(key): {model.vocabulary.tokens[word]: model.ngrams[key << id_bits | word]
+                                        for word in followers}
+            for key, followers in model.context_followers().items()} == ngrams, "the counts differ"
+    count = sum(len(counter) for counter in ngrams.values())
+    print("{:<20} n={} {} n-grams: string tuples {:.1f} MB ({:.0f} B/n-gram); "
+          "vocabulary and packed ids {:.1f} MB ({:.0f} B/n-gram)".format(
+              os.path.basename(path), n, count, strings_size / 1e6, strings_size / count,
+              model_size / 1e6, model_size / count))
+
+
+def trained_model_from_text(module, text, n):
+    model = module.NGramModel(n)
+    model.update(text)
+    return model
+
+
+if __name__ == '__main__':
+    args = arg_parser.parse_args()
+    module = load_model_module(args.model)
+    for n in args.n:
+        report_sampling(module, args.train, n, args.tokens, args.reference_tokens)
+        report_memory(module, args.train, n)
+        if hasattr(module.NGramModel, "score_corpus"):
+            report_scoring(module, args.train, args.test, n)